@@ -0,0 +1,45 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite, настроенный для одновременной работы нескольких процессов.
+
+    Каждое новое соединение получает прагмы из PRAGMAS, которые можно
+    переопределить в `OPTIONS['pragmas']`. В режиме WAL читатели не
+    ждут писателя. `OPTIONS['transaction_mode']` задаёт, чем
+    начинаются транзакции: при IMMEDIATE блокировка на запись берётся
+    сразу, и конкурирующий писатель ждёт её `OPTIONS['timeout']`
+    секунд, а не получает «database is locked» посреди транзакции.
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **params.pop('pragmas', {})}
+        self.transaction_mode = params.pop(
+            'transaction_mode', 'DEFERRED'
+        ).upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f'OPTIONS["transaction_mode"] должен быть одним из '
+                f'{", ".join(TRANSACTION_MODES)}.'
+            )
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
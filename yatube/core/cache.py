@@ -0,0 +1,375 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'YTCACHE2'
+HEADER = struct.Struct('<8sIIIQQ')
+SLOT = struct.Struct('<QdQQIHHH2x')
+
+Slot = namedtuple(
+    'Slot', 'hash expires accessed stamp length key_length part parts'
+)
+
+
+class SharedMemoryCache(BaseCache):
+    """Кеш в файле, отображённом в память и общем для всех процессов узла.
+
+    Файл (`LOCATION` с раскладкой в имени, например
+    `cache-256x8x32768`) разбит на слоты одинакового размера
+    (`OPTIONS['SLOT_SIZE']`), общий объём ограничен
+    `OPTIONS['MAX_SIZE']`. Каждый ключ попадает в набор из
+    `OPTIONS['WAYS']` слотов; значение больше слота занимает цепочку
+    слотов своего набора. При нехватке места вытесняются записи
+    набора, к которым дольше всего не обращались. Все изменения
+    выполняются под файловой блокировкой, поэтому `add`, `incr` и
+    версии ключей атомарны между процессами. Значения больше всего
+    набора не кешируются: это пишется в журнал и считается в
+    `stats()`.
+
+    Из файла загружаются pickle-объекты, поэтому он и его каталог
+    должны принадлежать текущему пользователю и быть закрыты для
+    остальных; чужой файл кеш не открывает.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._slot_size = int(options.get('SLOT_SIZE', 32 * 1024))
+        self._ways = int(options.get('WAYS', 8))
+        max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._sets = max(1, max_size // (self._slot_size * self._ways))
+        self._slot_count = self._sets * self._ways
+        # Файл с другой раскладкой нельзя ни обрезать, ни перезаписать:
+        # другие процессы держат его в памяти и получат SIGBUS.
+        self._path = (
+            f'{location}-{self._sets}x{self._ways}x{self._slot_size}'
+        )
+        self._size = HEADER.size + self._slot_count * self._slot_size
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @staticmethod
+    def _check_private(status, path):
+        if status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise ImproperlyConfigured(
+                f'Файл кеша {path} принадлежит другому пользователю '
+                f'или доступен ему'
+            )
+
+    def _open(self):
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            self._check_private(os.stat(directory), directory)
+        fd = os.open(
+            self._path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600
+        )
+        try:
+            status = os.fstat(fd)
+            if not stat.S_ISREG(status.st_mode):
+                raise ImproperlyConfigured(
+                    f'Файл кеша {self._path} не обычный файл'
+                )
+            self._check_private(status, self._path)
+        except ImproperlyConfigured:
+            os.close(fd)
+            raise
+        self._fd = fd
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            self._map_file()
+        except ImproperlyConfigured:
+            self._fd = None
+            os.close(fd)
+            raise
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        self._pid = os.getpid()
+
+    def _map_file(self):
+        """Отобразить файл в память, создав заголовок у нового файла.
+
+        Файл только растёт от нуля до нужного размера; файл другого
+        размера или с чужим заголовком не трогается.
+        """
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            os.ftruncate(self._fd, self._size)
+        elif size != self._size:
+            raise ImproperlyConfigured(
+                f'Размер файла кеша {self._path} не совпадает с настройками'
+            )
+        self._map = mmap.mmap(self._fd, self._size)
+        header = HEADER.unpack_from(self._map)
+        if header[0] == bytes(len(MAGIC)):
+            HEADER.pack_into(
+                self._map, 0, MAGIC, self._slot_size,
+                self._slot_count, self._ways, 0, 0
+            )
+        elif header[:4] != (
+            MAGIC, self._slot_size, self._slot_count, self._ways
+        ):
+            self._map.close()
+            self._map = None
+            raise ImproperlyConfigured(
+                f'Файл кеша {self._path} другой версии или раскладки'
+            )
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            # После fork дескриптор и блокировка общие с родителем,
+            # поэтому каждый процесс открывает файл заново.
+            if self._pid != os.getpid():
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _tick(self):
+        header = HEADER.unpack_from(self._map)
+        clock = header[4] + 1
+        HEADER.pack_into(self._map, 0, *header[:4], clock, header[5])
+        return clock
+
+    def _count_oversized(self):
+        header = HEADER.unpack_from(self._map)
+        HEADER.pack_into(self._map, 0, *header[:5], header[5] + 1)
+
+    def stats(self):
+        """Счётчики кеша, общие для всех процессов."""
+        with self._locked():
+            return {'oversized': HEADER.unpack_from(self._map)[5]}
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _offset(self, index):
+        return HEADER.size + index * self._slot_size
+
+    def _slots(self, key_hash):
+        first = (key_hash % self._sets) * self._ways
+        return range(first, first + self._ways)
+
+    def _read(self, index):
+        return Slot._make(SLOT.unpack_from(self._map, self._offset(index)))
+
+    def _entries(self, key_hash):
+        """Записи набора ключа: (хеш, метка) -> слоты по порядку частей.
+
+        Неполные цепочки (часть вытеснена или не дописана) в
+        результат не попадают, их слоты считаются свободными.
+        """
+        parts = {}
+        for index in self._slots(key_hash):
+            slot = self._read(index)
+            if slot.hash:
+                parts.setdefault((slot.hash, slot.stamp), {})[
+                    slot.part
+                ] = (index, slot)
+        entries = {}
+        for entry, found in parts.items():
+            head = found.get(0)
+            if head and len(found) == head[1].parts:
+                entries[entry] = [found[part] for part in range(len(found))]
+        return entries
+
+    def _find(self, key, key_hash, now):
+        for (slot_hash, _), chain in self._entries(key_hash).items():
+            index, head = chain[0]
+            if slot_hash != key_hash:
+                continue
+            start = self._offset(index) + SLOT.size
+            if self._map[start:start + head.key_length] != key:
+                continue
+            indexes = [index for index, _ in chain]
+            if head.expires and head.expires <= now:
+                self._clear(indexes)
+                return None
+            return indexes
+        return None
+
+    def _allocate(self, key_hash, count, now):
+        """Освободить в наборе ключа `count` слотов и вернуть их."""
+        entries = sorted(
+            self._entries(key_hash).values(),
+            key=lambda chain: chain[0][1].accessed,
+        )
+        taken = {index for chain in entries for index, _ in chain}
+        free = [
+            index for index in self._slots(key_hash) if index not in taken
+        ]
+        for chain in entries:
+            expires = chain[0][1].expires
+            if expires and expires <= now:
+                free.extend(index for index, _ in chain)
+        live = [chain for chain in entries
+                if not chain[0][1].expires or chain[0][1].expires > now]
+        while len(free) < count:
+            free.extend(index for index, _ in live.pop(0))
+        free = free[:count]
+        self._clear(free)
+        return free
+
+    def _clear(self, indexes):
+        for index in indexes:
+            SLOT.pack_into(
+                self._map, self._offset(index), 0, 0.0, 0, 0, 0, 0, 0, 0
+            )
+
+    def _value(self, indexes):
+        chunks = []
+        for index in indexes:
+            slot = self._read(index)
+            start = self._offset(index) + SLOT.size + slot.key_length
+            chunks.append(self._map[start:start + slot.length])
+        return b''.join(chunks)
+
+    def _chunks(self, key, payload):
+        room = self._slot_size - SLOT.size
+        first = room - len(key)
+        chunks = [payload[:first]]
+        for start in range(first, len(payload), room):
+            chunks.append(payload[start:start + room])
+        return chunks
+
+    def _write(self, indexes, key, key_hash, chunks, expires):
+        stamp = self._tick()
+        for part, (index, chunk) in enumerate(zip(indexes, chunks)):
+            head = b'' if part else key
+            start = self._offset(index)
+            SLOT.pack_into(
+                self._map, start, key_hash, expires, stamp, stamp,
+                len(chunk), len(head), part, len(chunks)
+            )
+            start += SLOT.size
+            self._map[start:start + len(head)] = head
+            start += len(head)
+            self._map[start:start + len(chunk)] = chunk
+
+    def _put(self, key, key_hash, payload, expires, now):
+        chunks = self._chunks(key, payload)
+        if len(chunks) > self._ways:
+            self._count_oversized()
+            logger.warning(
+                'Значение ключа %s (%s байт) больше набора слотов кеша '
+                'и не сохранено', key.decode(), len(payload)
+            )
+            return False
+        indexes = self._allocate(key_hash, len(chunks), now)
+        self._write(indexes, key, key_hash, chunks, expires)
+        return True
+
+    def _prepare(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        key = key.encode()
+        return key, self._hash(key)
+
+    def _expires(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return 0.0 if expires is None else expires
+
+    def _store(self, key, value, timeout, version, only_new):
+        key, key_hash = self._prepare(key, version)
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self._expires(timeout)
+        now = time.time()
+        with self._locked():
+            indexes = self._find(key, key_hash, now)
+            if indexes is not None:
+                if only_new:
+                    return False
+                self._clear(indexes)
+            return self._put(key, key_hash, payload, expires, now)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, only_new=True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version, only_new=False)
+
+    def get(self, key, default=None, version=None):
+        key, key_hash = self._prepare(key, version)
+        with self._locked():
+            indexes = self._find(key, key_hash, time.time())
+            if indexes is None:
+                return default
+            head = self._read(indexes[0])._replace(accessed=self._tick())
+            SLOT.pack_into(self._map, self._offset(indexes[0]), *head)
+            payload = self._value(indexes)
+        return pickle.loads(payload)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        for key in keys:
+            value = self.get(key, self, version=version)
+            if value is not self:
+                found[key] = value
+        return found
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, key_hash = self._prepare(key, version)
+        with self._locked():
+            indexes = self._find(key, key_hash, time.time())
+            if indexes is None:
+                return False
+            head = self._read(indexes[0])._replace(
+                expires=self._expires(timeout)
+            )
+            SLOT.pack_into(self._map, self._offset(indexes[0]), *head)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key, key_hash = self._prepare(key, version)
+        now = time.time()
+        with self._locked():
+            indexes = self._find(key, key_hash, now)
+            if indexes is None:
+                raise ValueError(f"Key '{key.decode()}' not found")
+            expires = self._read(indexes[0]).expires
+            value = pickle.loads(self._value(indexes)) + delta
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self._clear(indexes)
+            self._put(key, key_hash, payload, expires, now)
+        return value
+
+    def delete(self, key, version=None):
+        key, key_hash = self._prepare(key, version)
+        with self._locked():
+            indexes = self._find(key, key_hash, time.time())
+            if indexes is not None:
+                self._clear(indexes)
+
+    def has_key(self, key, version=None):
+        key, key_hash = self._prepare(key, version)
+        with self._locked():
+            return self._find(key, key_hash, time.time()) is not None
+
+    def clear(self):
+        with self._locked():
+            self._clear(range(self._slot_count))
+
+    def close(self, **kwargs):
+        # Отображение живёт весь срок процесса и переиспользуется
+        # между запросами, как соединение с memcached.
+        pass
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+TRANSPOSED = {5, 6, 7, 8}
+KEPT_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+SAVE_OPTIONS = {
+    'JPEG': {'optimize': True, 'progressive': True},
+    'WEBP': {'method': 4},
+}
+
+
+def render(data, widths, ratio, formats, quality):
+    """Нарезать картинку на варианты нескольких ширин и форматов.
+
+    Картинка обрезается по центру до пропорций `ratio` и
+    уменьшается до каждой ширины из `widths`, не превышающей
+    исходную (если исходная уже всех, берётся самая узкая).
+    Возвращает список (формат, ширина, высота, байты). Функция не
+    обращается к Django и может выполняться в отдельном процессе.
+    """
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    aspect = ratio[0] / ratio[1]
+    if image.width / image.height > aspect:
+        size = (round(image.height * aspect), image.height)
+    else:
+        size = (image.width, round(image.width / aspect))
+    image = ImageOps.fit(image, size, Image.LANCZOS)
+    sizes = [width for width in sorted(widths) if width <= image.width]
+    rendered = []
+    for width in sizes or sorted(widths)[:1]:
+        height = max(1, round(width / aspect))
+        variant = image.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            image_format = image_format.upper()
+            content = BytesIO()
+            variant.save(
+                content, image_format, quality=quality,
+                **SAVE_OPTIONS.get(image_format, {})
+            )
+            rendered.append(
+                (image_format, width, height, content.getvalue())
+            )
+    return rendered
+
+
+def describe(data, placeholder_width):
+    """Размеры, объём, хеш содержимого и крошечное превью картинки.
+
+    Превью (LQIP) — JPEG шириной `placeholder_width` в виде data URI,
+    который можно вставить прямо в страницу. Для него JPEG
+    декодируется в уменьшенном режиме (`draft`), поэтому описание
+    большой фотографии не требует памяти под её полный размер.
+    """
+    with Image.open(BytesIO(data)) as source:
+        width, height = source.size
+        if source.getexif().get(0x0112) in TRANSPOSED:
+            width, height = height, width
+        source.draft('RGB', (placeholder_width * 2, placeholder_width * 2))
+        preview = ImageOps.exif_transpose(source).convert('RGB')
+    preview.thumbnail(
+        (placeholder_width, placeholder_width * height // width or 1),
+        Image.LANCZOS,
+    )
+    content = BytesIO()
+    preview.save(content, 'JPEG', quality=40)
+    return {
+        'width': width,
+        'height': height,
+        'size': len(data),
+        'hash': hashlib.sha256(data).hexdigest(),
+        'placeholder': 'data:image/jpeg;base64,' + base64.b64encode(
+            content.getvalue()
+        ).decode(),
+    }
+
+
+def normalize(source, max_dimension, quality):
+    """Повернуть по EXIF, уменьшить и пересохранить картинку без метаданных.
+
+    Картинка вписывается в квадрат `max_dimension`. JPEG сразу
+    декодируется в уменьшенном в 2–8 раз виде (`draft`), а
+    дальнейшее уменьшение идёт через `reduce`, поэтому память не
+    зависит от исходного разрешения. Анимации не трогаются.
+    Возвращает (формат, байты) или None, если картинку надо
+    оставить как есть.
+    """
+    with Image.open(source) as image:
+        if getattr(image, 'n_frames', 1) > 1:
+            return None
+        image_format = image.format
+        if image_format not in KEPT_FORMATS:
+            image_format = 'PNG'
+        icc_profile = image.info.get('icc_profile')
+        image.draft(None, (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(
+            (max_dimension, max_dimension), Image.LANCZOS, reducing_gap=2.0
+        )
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    options = dict(SAVE_OPTIONS.get(image_format, {}), quality=quality)
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    if image.mode == 'P' and 'transparency' in image.info:
+        options['transparency'] = image.info['transparency']
+    content = BytesIO()
+    image.save(content, image_format, **options)
+    return image_format, content.getvalue()
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+CLAIM_CANDIDATES = 10
+ABANDONED = 'Исполнитель не отчитался о последней попытке'
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def task_path(task):
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, *args, priority=0, delay=0, max_attempts=None):
+    """Поставить вызов `task(*args)` в очередь.
+
+    `task` — функция уровня модуля или путь к ней, аргументы должны
+    сериализоваться в JSON. Внутри транзакции задача станет видна
+    исполнителям только после фиксации и пропадёт при откате.
+    """
+    return Job.objects.create(
+        task=task_path(task),
+        arguments=json.dumps(args),
+        priority=priority,
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+
+
+def _available(now):
+    return Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now, attempts__lt=F('max_attempts')
+    ).filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+
+
+def _abandon_exhausted(now):
+    """Пометить FAILED задачи, брошенные на последней попытке.
+
+    Задача, на которой умирает исполнитель (OOM, SIGKILL), сама
+    не упадёт, и без этого её брали бы снова и снова.
+    """
+    Job.objects.filter(
+        status=Job.QUEUED,
+        attempts__gte=F('max_attempts'),
+        locked_until__lt=now,
+    ).update(
+        status=Job.FAILED,
+        locked_until=None,
+        last_error=ABANDONED,
+    )
+
+
+def claim(worker):
+    """Занять самую срочную доступную задачу или вернуть None.
+
+    Задача занимается условным UPDATE, поэтому из нескольких
+    исполнителей её получит только один. Если исполнитель не
+    отчитается до `locked_until`, задачу возьмёт другой, но не
+    больше `max_attempts` раз.
+    """
+    now = timezone.now()
+    _abandon_exhausted(now)
+    locked_until = now + timedelta(seconds=settings.JOBS_VISIBILITY_TIMEOUT)
+    candidates = _available(now).values_list('pk', flat=True)
+    for pk in candidates[:CLAIM_CANDIDATES]:
+        if _available(now).filter(pk=pk).update(
+            locked_by=worker,
+            locked_until=locked_until,
+            attempts=F('attempts') + 1,
+        ):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def retry_delay(attempts):
+    delay = min(
+        settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1),
+        settings.JOBS_RETRY_BACKOFF_MAX,
+    )
+    return delay * random.uniform(1, 1.5)
+
+
+def perform(job):
+    """Выполнить занятую задачу: удалить при успехе, иначе отложить."""
+    owned = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    try:
+        import_string(job.task)(*json.loads(job.arguments))
+    except Exception:
+        logger.exception('Задача %s завершилась ошибкой', job)
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            owned.update(status=Job.FAILED, locked_until=None,
+                         last_error=error)
+        else:
+            owned.update(
+                run_at=timezone.now() + timedelta(
+                    seconds=retry_delay(job.attempts)
+                ),
+                locked_by='',
+                locked_until=None,
+                last_error=error,
+            )
+        return False
+    owned.delete()
+    return True
+
+
+def work(worker=None, burst=False, stopped=lambda: False):
+    """Выполнять задачи, пока `stopped()` не вернёт True.
+
+    С `burst` возвращается, как только доступных задач не осталось.
+    Возвращает число выполненных задач.
+    """
+    worker = worker or worker_name()
+    done = 0
+    while not stopped():
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            time.sleep(settings.JOBS_POLL_INTERVAL)
+            continue
+        done += perform(job)
+    return done
@@ -0,0 +1,127 @@
+import copy
+import logging
+import pickle
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.jobs import ABANDONED, retry_delay
+from core.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxBackend(BaseEmailBackend):
+    """Почтовый бэкенд, который только записывает письма в таблицу.
+
+    Запись идёт в текущей транзакции, так что письмо уходит, только
+    если зафиксировано то, о чём оно сообщает. Доставляет письма
+    `manage.py send_outbox` через OUTBOX_EMAIL_BACKEND.
+    """
+
+    def send_messages(self, email_messages):
+        emails = []
+        for message in email_messages:
+            message = copy.copy(message)
+            message.connection = None
+            emails.append(OutboxEmail(
+                subject=message.subject[:255],
+                recipients=', '.join(message.recipients()),
+                message=pickle.dumps(message, pickle.HIGHEST_PROTOCOL),
+            ))
+        OutboxEmail.objects.bulk_create(emails)
+        return len(emails)
+
+
+def _available(now):
+    return OutboxEmail.objects.filter(
+        status=OutboxEmail.QUEUED,
+        send_after__lte=now,
+        attempts__lt=settings.OUTBOX_MAX_ATTEMPTS,
+    ).filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+
+
+def _abandon_exhausted(now):
+    OutboxEmail.objects.filter(
+        status=OutboxEmail.QUEUED,
+        attempts__gte=settings.OUTBOX_MAX_ATTEMPTS,
+        locked_until__lt=now,
+    ).update(status=OutboxEmail.DEAD, locked_until=None, last_error=ABANDONED)
+
+
+def claim(limit):
+    """Занять до `limit` писем, готовых к отправке.
+
+    Письма, отправитель которых пропал на последней попытке,
+    помечаются недоставленными.
+    """
+    now = timezone.now()
+    _abandon_exhausted(now)
+    ids = list(_available(now).values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    locked_until = now + timedelta(seconds=settings.OUTBOX_VISIBILITY_TIMEOUT)
+    _available(now).filter(pk__in=ids).update(
+        locked_until=locked_until, attempts=F('attempts') + 1
+    )
+    return list(
+        OutboxEmail.objects.filter(pk__in=ids, locked_until=locked_until)
+    )
+
+
+def _fail(email, error):
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        fields = {'status': OutboxEmail.DEAD}
+    else:
+        fields = {'send_after': timezone.now() + timedelta(
+            seconds=retry_delay(email.attempts)
+        )}
+    OutboxEmail.objects.filter(pk=email.pk).update(
+        locked_until=None, last_error=error, **fields
+    )
+
+
+def deliver(emails, connection):
+    """Отправить занятые письма через открытое соединение."""
+    sent = []
+    for email in emails:
+        try:
+            connection.send_messages([pickle.loads(email.message)])
+        except Exception:
+            logger.exception('Не удалось отправить письмо %s', email.pk)
+            _fail(email, traceback.format_exc())
+        else:
+            sent.append(email.pk)
+    OutboxEmail.objects.filter(pk__in=sent).delete()
+    return len(sent)
+
+
+def drain(batch_size, burst=False, stopped=lambda: False):
+    """Отправлять письма пачками, пока `stopped()` не вернёт True.
+
+    Соединение с почтовым сервером открывается один раз и живёт,
+    пока в очереди есть письма. С `burst` функция возвращается, когда
+    очередь опустела. Возвращает число отправленных писем.
+    """
+    connection = get_connection(settings.OUTBOX_EMAIL_BACKEND)
+    sent = 0
+    try:
+        while not stopped():
+            emails = claim(batch_size)
+            if not emails:
+                connection.close()
+                if burst:
+                    break
+                time.sleep(settings.OUTBOX_POLL_INTERVAL)
+                continue
+            connection.open()
+            sent += deliver(emails, connection)
+    finally:
+        connection.close()
+    return sent
@@ -0,0 +1,68 @@
+import signal
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в базе данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Число процессов-исполнителей',
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Завершиться, когда доступных задач не останется',
+        )
+
+    def work(self, burst):
+        stopping = []
+
+        def stop(signum, frame):
+            stopping.append(signum)
+
+        # Текущая задача доделывается, новые не берутся.
+        previous = {
+            signum: signal.signal(signum, stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            return jobs.work(burst=burst, stopped=lambda: stopping)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        if options['processes'] == 1:
+            done = self.work(options['burst'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Выполнено задач: {done}'
+            ))
+            return
+        # Дочерние процессы не должны унаследовать соединение с базой.
+        connections.close_all()
+        context = get_context('fork')
+        processes = [
+            context.Process(target=self.work, args=(options['burst'],))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+
+        def forward(signum, frame):
+            for process in processes:
+                process.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
@@ -0,0 +1,54 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import replica
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в файл реплики при изменениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help=(
+                'Проверять изменения каждые столько секунд; '
+                'без параметра — синхронизировать один раз'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if not replica.configured():
+            raise CommandError(
+                'Реплика не настроена: задайте DB_REPLICA_NAME.'
+            )
+        stopping = []
+
+        def stop(signum, frame):
+            stopping.append(signum)
+
+        previous = {
+            signum: signal.signal(signum, stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        synced = 0
+        version = None
+        try:
+            while not stopping:
+                current = replica.data_version()
+                if current != version:
+                    replica.sync()
+                    synced += 1
+                    version = current
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(
+            f'Синхронизаций реплики: {synced}'
+        ))
@@ -0,0 +1,160 @@
+from django.db import models
+from django.utils import timezone
+
+
+class StoredFile(models.Model):
+    name = models.CharField(
+        'Имя файла',
+        max_length=255,
+        unique=True,
+    )
+    references = models.PositiveIntegerField(
+        'Число ссылок',
+        default=0,
+        help_text='Сколько записей ссылается на этот файл',
+    )
+
+    class Meta:
+        verbose_name = 'Файл хранилища'
+        verbose_name_plural = 'Файлы хранилища'
+
+    def __str__(self):
+        return self.name
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (FAILED, 'Не выполнено'),
+    )
+
+    task = models.CharField(
+        'Задача',
+        max_length=200,
+        help_text='Путь к функции, например posts.images.generate',
+    )
+    arguments = models.TextField(
+        'Аргументы',
+        default='[]',
+        help_text='Позиционные аргументы задачи в формате JSON',
+    )
+    status = models.CharField(
+        'Состояние',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    priority = models.SmallIntegerField(
+        'Приоритет',
+        default=0,
+        help_text='Задачи с меньшим числом выполняются раньше',
+    )
+    run_at = models.DateTimeField(
+        'Выполнить не раньше',
+        default=timezone.now,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Попыток',
+        default=0,
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        'Попыток не больше',
+        default=5,
+    )
+    locked_by = models.CharField(
+        'Исполнитель',
+        max_length=100,
+        blank=True,
+    )
+    locked_until = models.DateTimeField(
+        'Занята до',
+        null=True,
+        blank=True,
+        help_text='После этого момента задачу может взять другой исполнитель',
+    )
+    last_error = models.TextField(
+        'Последняя ошибка',
+        blank=True,
+    )
+    created = models.DateTimeField(
+        'Создана',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        ordering = ('priority', 'run_at', 'pk')
+        indexes = (
+            models.Index(
+                fields=('status', 'priority', 'run_at'),
+                name='job_queue_order',
+            ),
+        )
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f'{self.task} #{self.pk}'
+
+
+class OutboxEmail(models.Model):
+    QUEUED = 'queued'
+    DEAD = 'dead'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (DEAD, 'Не доставлено'),
+    )
+
+    subject = models.CharField(
+        'Тема',
+        max_length=255,
+    )
+    recipients = models.TextField(
+        'Получатели',
+    )
+    message = models.BinaryField(
+        'Письмо',
+        help_text='Сериализованный EmailMessage',
+    )
+    status = models.CharField(
+        'Состояние',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Попыток',
+        default=0,
+    )
+    send_after = models.DateTimeField(
+        'Отправить не раньше',
+        default=timezone.now,
+    )
+    locked_until = models.DateTimeField(
+        'Занято до',
+        null=True,
+        blank=True,
+    )
+    last_error = models.TextField(
+        'Последняя ошибка',
+        blank=True,
+    )
+    created = models.DateTimeField(
+        'Создано',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        ordering = ('send_after', 'pk')
+        indexes = (
+            models.Index(
+                fields=('status', 'send_after'),
+                name='outbox_queue_order',
+            ),
+        )
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+
+    def __str__(self):
+        return self.subject
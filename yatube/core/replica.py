@@ -0,0 +1,138 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.sqlite3.base import Database
+from django.dispatch import Signal
+
+PIN_KEY = 'db:primary:{}'
+
+replica_synced = Signal()
+
+_use_replica = ContextVar('use_replica', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+
+def configured():
+    return settings.REPLICA_DATABASE in connections
+
+
+def replica_reads(view):
+    """Разрешить представлению читать из реплики.
+
+    Представление не должно ничего записывать и читать то, что только
+    что записало: реплика отстаёт от основной базы.
+    """
+    view.replica_reads = True
+    return view
+
+
+def record_write():
+    _wrote.set(True)
+
+
+def pin(user_id):
+    """Читать запросы пользователя из основной базы REPLICA_STICKY_SECONDS
+    секунд, пока его запись не дойдёт до реплики."""
+    cache.set(PIN_KEY.format(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user_id):
+    return user_id is not None and bool(cache.get(PIN_KEY.format(user_id)))
+
+
+def read_alias():
+    """Псевдоним базы, из которой сейчас читают представления.
+
+    Кешируемые фрагментами страницы зависят от него: реплика может
+    отставать, и её фрагмент не должен попасть к тем, кто читает
+    основную базу.
+    """
+    if _use_replica.get() and configured():
+        return settings.REPLICA_DATABASE
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """Чтение из реплики внутри помеченных представлений, остальное —
+    в основную базу. Записи всегда идут в основную базу, даже для
+    объектов, прочитанных из реплики."""
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias()
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == settings.REPLICA_DATABASE:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """Включает чтение из реплики для представлений `replica_reads`.
+
+    Пользователь, который записал что-то за время запроса, следующие
+    REPLICA_STICKY_SECONDS секунд читает из основной базы и видит
+    свою запись.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        use_replica = _use_replica.set(False)
+        wrote = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get() and request.user.is_authenticated:
+                pin(request.user.pk)
+        finally:
+            _use_replica.reset(use_replica)
+            _wrote.reset(wrote)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Сессия и пользователь загружаются здесь, до переключения,
+        # поэтому только что вошедший пользователь не теряет вход.
+        if (
+            getattr(view_func, 'replica_reads', False)
+            and configured()
+            and not is_pinned(request.user.pk)
+        ):
+            _use_replica.set(True)
+
+
+def data_version(alias=DEFAULT_DB_ALIAS):
+    """Номер версии базы, который меняется при фиксации транзакций
+    другими соединениями."""
+    with connections[alias].cursor() as cursor:
+        cursor.execute('PRAGMA data_version')
+        return cursor.fetchone()[0]
+
+
+def sync(source=DEFAULT_DB_ALIAS, target=None):
+    """Скопировать основную базу в файл реплики целиком.
+
+    Копия делается онлайн-резервированием SQLite за один шаг: запись
+    в основную базу в режиме WAL при этом не останавливается, а
+    читатели реплики видят либо старую, либо новую копию.
+    """
+    source = connections[source]
+    target = connections[target or settings.REPLICA_DATABASE]
+    source.ensure_connection()
+    destination = Database.connect(
+        target.settings_dict['NAME'],
+        timeout=target.settings_dict['OPTIONS'].get('timeout', 5),
+    )
+    try:
+        source.connection.backup(destination)
+    finally:
+        destination.close()
+    replica_synced.send(sender=sync)
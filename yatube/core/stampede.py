@@ -0,0 +1,72 @@
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+LOCK_TIMEOUT = 30
+STALE_TIMEOUT = 60
+WAIT_TIMEOUT = 2.0
+WAIT_STEP = 0.05
+
+
+def _lock_key(key):
+    return f'{key}:lock'
+
+
+def _wait_for(key, deadline):
+    """Ждать, пока держатель блокировки сохранит значение.
+
+    Если блокировку сняли, а значения нет (пересчёт упал или значение
+    не поместилось в кеш), ждать дальше бессмысленно.
+    """
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if not cache.has_key(_lock_key(key)):
+            return cache.get(key)
+    return None
+
+
+def get_or_compute(key, compute, timeout, beta=1.0):
+    """Вернуть значение из кеша, пересчитывая его одним запросом.
+
+    Запись хранит время пересчёта и логический срок годности и живёт
+    в кеше ещё STALE_TIMEOUT секунд после него. Незадолго до срока
+    запись вероятностно обновляется заранее (XFetch): чем дороже
+    пересчёт, тем раньше. Пересчитывает тот, кто взял блокировку
+    через `cache.add`; остальные получают устаревшее значение, а если
+    его нет — ждут результата, пока блокировка не снята, но не
+    дольше WAIT_TIMEOUT, и затем считают сами.
+    """
+    entry = cache.get(key)
+    locked = False
+    if entry is not None:
+        value, delta, expires = entry
+        early = delta * beta * math.log(1.0 - random.random())
+        if time.time() - early < expires:
+            return value
+        if not cache.add(_lock_key(key), 1, LOCK_TIMEOUT):
+            return value
+        locked = True
+    elif cache.add(_lock_key(key), 1, LOCK_TIMEOUT):
+        locked = True
+    else:
+        entry = _wait_for(key, time.monotonic() + WAIT_TIMEOUT)
+        if entry is not None:
+            return entry[0]
+    try:
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        cache.set(
+            key,
+            (value, delta, time.time() + timeout),
+            timeout + STALE_TIMEOUT,
+        )
+    finally:
+        if locked:
+            cache.delete(_lock_key(key))
+    return value
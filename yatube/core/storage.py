@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import os
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from core.models import StoredFile
+
+logger = logging.getLogger(__name__)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по SHA-256 содержимого.
+
+    `posts/cat.jpg` сохраняется как `posts/ab/cd/abcd…ef.jpg`: первые
+    `depth` пар символов хеша задают вложенные каталоги, поэтому ни
+    в одном каталоге не скапливаются миллионы файлов. Одинаковое
+    содержимое хранится один раз, а `StoredFile` считает ссылки на
+    него: `save` добавляет ссылку, `delete` снимает её и удаляет
+    файл после фиксации транзакции, когда ссылок не осталось.
+    """
+
+    def __init__(self, *args, depth=2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.depth = depth
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        shards = [digest[2 * i:2 * i + 2] for i in range(self.depth)]
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, *shards, digest + extension)
+
+    def is_hashed(self, name):
+        parts = name.split('/')
+        digest = os.path.splitext(parts[-1])[0]
+        shards = parts[-1 - self.depth:-1]
+        return len(digest) == 64 and len(parts) > self.depth and shards == [
+            digest[2 * i:2 * i + 2] for i in range(self.depth)
+        ]
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if not self.exists(name):
+            name = super().save(name, content, max_length=max_length)
+        self.reference(name)
+        return name
+
+    def reference(self, name):
+        updated = StoredFile.objects.filter(name=name).update(
+            references=F('references') + 1
+        )
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                StoredFile.objects.create(name=name, references=1)
+        except IntegrityError:
+            self.reference(name)
+
+    def delete(self, name):
+        stored = StoredFile.objects.filter(name=name)
+        with transaction.atomic():
+            if stored.filter(references__gt=1).update(
+                references=F('references') - 1
+            ):
+                return
+            stored.delete()
+        transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def purge(self, name):
+        """Удалить файл без ссылок сразу, вместе с его счётчиком.
+
+        Файл, на который есть ссылки (например, от поста, который
+        ещё сохраняется), не трогается; тогда возвращается False.
+        """
+        stored = StoredFile.objects.filter(name=name)
+        with transaction.atomic():
+            if stored.filter(references__gt=0).exists():
+                return False
+            stored.delete()
+            super().delete(name)
+        return True
+
+    def _delete_unreferenced(self, name):
+        if StoredFile.objects.filter(name=name).exists():
+            return
+        try:
+            super().delete(name)
+        except (OSError, SuspiciousFileOperation):
+            logger.exception('Не удалось удалить файл %s', name)
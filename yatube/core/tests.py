@@ -0,0 +1,545 @@
+import base64
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from multiprocessing import get_context
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail as django_mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import (IntegrityError, OperationalError, connection,
+                       transaction)
+from django.urls import reverse
+from django.utils import timezone
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from PIL import Image
+
+from core import images, jobs, mail, stampede, writes
+from core.backends.sqlite3.base import DatabaseWrapper
+from core.cache import SharedMemoryCache
+from core.models import Job, OutboxEmail, StoredFile
+from core.storage import ContentAddressedStorage
+
+PERFORMED = []
+
+
+def record(*args):
+    PERFORMED.append(args)
+
+
+def explode():
+    raise RuntimeError('Сбой задачи')
+
+
+def store(name):
+    return StoredFile.objects.create(name=name).pk
+
+
+def make_cache(path, **options):
+    return SharedMemoryCache(path, {'OPTIONS': options})
+
+
+def increment(path, times):
+    cache = make_cache(path)
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SharedMemoryCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache')
+        self.cache = make_cache(self.path)
+
+    def test_get_set_add_delete(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertTrue(self.cache.add('new', 'other'))
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('new'))
+
+    def test_versions_and_expiry(self):
+        self.cache.set('key', 'first', version=1)
+        self.cache.set('key', 'second', version=2)
+        self.assertEqual(self.cache.get('key', version=1), 'first')
+        self.assertEqual(self.cache.get('key', version=2), 'second')
+        self.cache.set('expired', 'value', timeout=-1)
+        self.assertIsNone(self.cache.get('expired'))
+
+    def test_shared_between_instances(self):
+        make_cache(self.path).set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_lru_eviction_and_size_cap(self):
+        cache = make_cache(
+            self.path, MAX_SIZE=4 * 1024, SLOT_SIZE=1024, WAYS=4
+        )
+        for i in range(4):
+            cache.set(f'key{i}', i)
+        cache.get('key0')
+        cache.set('key4', 4)
+        self.assertEqual(cache.get('key0'), 0)
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(cache.get('key4'), 4)
+        cache.set('large', 'x' * 8192)
+        self.assertIsNone(cache.get('large'))
+        self.assertEqual(cache.stats(), {'oversized': 1})
+        self.assertLess(os.path.getsize(cache._path), 8 * 1024)
+
+    def test_large_value_chained_across_slots(self):
+        cache = make_cache(
+            self.path, MAX_SIZE=4 * 1024, SLOT_SIZE=1024, WAYS=4
+        )
+        cache.set('small', 1)
+        cache.set('large', 'x' * 2048)
+        self.assertEqual(cache.get('large'), 'x' * 2048)
+        self.assertEqual(cache.get('small'), 1)
+        cache.set('large', 'y' * 3000)
+        self.assertEqual(cache.get('large'), 'y' * 3000)
+        self.assertIsNone(cache.get('small'))
+        cache.set('small', 2)
+        self.assertIsNone(cache.get('large'))
+        self.assertEqual(cache.stats(), {'oversized': 0})
+        self.cache.set('fragment', 'x' * 40000)
+        self.assertEqual(self.cache.get('fragment'), 'x' * 40000)
+
+    def test_file_of_other_users_refused(self):
+        with open(self.cache._path, 'w'):
+            pass
+        os.chmod(self.cache._path, 0o644)
+        with self.assertRaises(ImproperlyConfigured):
+            self.cache.get('key')
+        os.chmod(self.cache._path, 0o600)
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(ImproperlyConfigured):
+                make_cache(self.path).get('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_other_geometry_never_resizes_live_file(self):
+        self.cache.set('key', 'value')
+        size = os.path.getsize(self.cache._path)
+        other = make_cache(self.path, MAX_SIZE=4 * 1024, SLOT_SIZE=1024)
+        other.set('key', 'other')
+        self.assertNotEqual(other._path, self.cache._path)
+        self.assertEqual(os.path.getsize(self.cache._path), size)
+        self.assertEqual(self.cache.get('key'), 'value')
+        with open(other._path, 'ab') as file:
+            file.write(b'x')
+        with self.assertRaises(ImproperlyConfigured):
+            make_cache(
+                self.path, MAX_SIZE=4 * 1024, SLOT_SIZE=1024
+            ).get('key')
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set('counter', 0)
+        context = get_context('fork')
+        workers = [
+            context.Process(target=increment, args=(self.path, 200))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 800)
+
+
+class GetOrComputeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value='fresh', delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_single_flight(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                stampede.get_or_compute(
+                    'key', self.compute(delay=0.2), timeout=60
+                )
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['fresh'] * 5)
+
+    def test_stale_value_while_refreshing(self):
+        cache.set('key', ('stale', 0.1, time.time() - 1))
+        cache.add('key:lock', 1)
+        value = stampede.get_or_compute('key', self.compute(), timeout=60)
+        self.assertEqual(value, 'stale')
+        self.assertEqual(self.calls, 0)
+
+    def test_waiters_stop_when_lock_released_without_value(self):
+        cache.add('key:lock', 1)
+        threading.Timer(0.2, cache.delete, args=('key:lock',)).start()
+        started = time.monotonic()
+        value = stampede.get_or_compute('key', self.compute(), timeout=60)
+        self.assertEqual(value, 'fresh')
+        self.assertLess(time.monotonic() - started, stampede.WAIT_TIMEOUT)
+
+    @mock.patch('core.stampede.WAIT_TIMEOUT', 0.1)
+    def test_lock_of_other_caller_kept(self):
+        cache.add('key:lock', 1)
+        value = stampede.get_or_compute('key', self.compute(), timeout=60)
+        self.assertEqual(value, 'fresh')
+        self.assertTrue(cache.has_key('key:lock'))
+
+    @mock.patch('core.stampede.random.random', return_value=0.5)
+    def test_early_refresh_before_expiry(self, random):
+        cache.set('key', ('cached', 0.0, time.time() + 10))
+        value = stampede.get_or_compute('key', self.compute(), timeout=60)
+        self.assertEqual(value, 'cached')
+        cache.set('key', ('cached', 1000.0, time.time() + 10))
+        value = stampede.get_or_compute('key', self.compute(), timeout=60)
+        self.assertEqual(value, 'fresh')
+        self.assertEqual(self.calls, 1)
+
+
+class RenderVariantsTest(SimpleTestCase):
+    def source(self, size):
+        content = BytesIO()
+        Image.new('RGB', size, 'red').save(content, 'PNG')
+        return content.getvalue()
+
+    def test_widths_formats_and_ratio(self):
+        rendered = images.render(
+            self.source((400, 400)), (100, 200, 800), (2, 1),
+            ('WEBP', 'JPEG'), 80
+        )
+        self.assertEqual(
+            [variant[:3] for variant in rendered],
+            [('WEBP', 100, 50), ('JPEG', 100, 50),
+             ('WEBP', 200, 100), ('JPEG', 200, 100)],
+        )
+        with Image.open(BytesIO(rendered[0][3])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (100, 50)))
+
+    def test_small_source_gets_smallest_width(self):
+        rendered = images.render(
+            self.source((30, 10)), (100, 200), (2, 1), ('JPEG',), 80
+        )
+        self.assertEqual([variant[:3] for variant in rendered],
+                         [('JPEG', 100, 50)])
+
+    def test_describe_reads_rotation_and_makes_placeholder(self):
+        content = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (400, 200), 'red').save(content, 'JPEG', exif=exif)
+        data = content.getvalue()
+        metadata = images.describe(data, 16)
+        self.assertEqual(
+            (metadata['width'], metadata['height'], metadata['size']),
+            (200, 400, len(data)),
+        )
+        self.assertEqual(len(metadata['hash']), 64)
+        prefix = 'data:image/jpeg;base64,'
+        self.assertTrue(metadata['placeholder'].startswith(prefix))
+        preview = base64.b64decode(metadata['placeholder'][len(prefix):])
+        with Image.open(BytesIO(preview)) as image:
+            self.assertEqual(image.size, (16, 32))
+
+
+class ContentAddressedStorageTest(TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+
+    def test_identical_content_stored_once(self):
+        first = self.storage.save('posts/a.PNG', ContentFile(b'image'))
+        second = self.storage.save('posts/b.png', ContentFile(b'image'))
+        self.assertEqual(first, second)
+        self.assertTrue(self.storage.is_hashed(first))
+        self.assertRegex(first, r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2')
+        self.assertTrue(first.endswith('.png'))
+        self.assertEqual(StoredFile.objects.get(name=first).references, 2)
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_untracked_file_deleted(self):
+        name = self.storage.path('posts/legacy.png')
+        os.makedirs(os.path.dirname(name))
+        with open(name, 'wb') as legacy:
+            legacy.write(b'image')
+        self.assertFalse(self.storage.is_hashed('posts/legacy.png'))
+        self.storage.delete('posts/legacy.png')
+        self.assertFalse(os.path.exists(name))
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        PERFORMED.clear()
+
+    def test_jobs_run_by_priority_and_removed(self):
+        jobs.enqueue(record, 'late', priority=5)
+        jobs.enqueue(record, 'urgent', 1, priority=-5)
+        jobs.enqueue(record, 'later', delay=60)
+        self.assertEqual(jobs.work('test', burst=True), 2)
+        self.assertEqual(PERFORMED, [('urgent', 1), ('late',)])
+        self.assertEqual(
+            list(Job.objects.values_list('arguments', flat=True)),
+            ['["later"]'],
+        )
+
+    def test_failed_job_retried_with_backoff_then_given_up(self):
+        job = jobs.enqueue(explode, max_attempts=2)
+        with mock.patch('core.jobs.random.uniform', return_value=1):
+            jobs.work('test', burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=9))
+        self.assertIn('Сбой задачи', job.last_error)
+        Job.objects.update(run_at=timezone.now())
+        jobs.work('test', burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNone(jobs.claim('test'))
+
+    def test_claimed_job_hidden_until_visibility_timeout(self):
+        job = jobs.enqueue(record, 'once')
+        self.assertEqual(jobs.claim('first').pk, job.pk)
+        self.assertIsNone(jobs.claim('second'))
+        Job.objects.update(locked_until=timezone.now() - timedelta(1))
+        stolen = jobs.claim('second')
+        self.assertEqual((stolen.pk, stolen.attempts), (job.pk, 2))
+        jobs.perform(stolen)
+        self.assertFalse(Job.objects.exists())
+
+    def test_job_of_dead_worker_failed_after_max_attempts(self):
+        job = jobs.enqueue(record, 'poison', max_attempts=2)
+        for worker in ('first', 'second'):
+            self.assertEqual(jobs.claim(worker).pk, job.pk)
+            self.assertIsNone(jobs.claim('other'))
+            Job.objects.update(locked_until=timezone.now() - timedelta(1))
+        self.assertIsNone(jobs.claim('third'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(job.last_error, jobs.ABANDONED)
+
+    def test_job_enqueued_in_rolled_back_transaction_dropped(self):
+        try:
+            with transaction.atomic():
+                jobs.enqueue(record, 'never')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Job.objects.exists())
+
+    def test_runworker_burst(self):
+        jobs.enqueue(record, 'command')
+        output = StringIO()
+        call_command('runworker', burst=True, stdout=output)
+        self.assertEqual(PERFORMED, [('command',)])
+        self.assertIn('Выполнено задач: 1', output.getvalue())
+
+
+@override_settings(
+    EMAIL_BACKEND='core.mail.OutboxBackend',
+    OUTBOX_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class OutboxTest(TestCase):
+    def test_password_reset_mail_queued_not_sent(self):
+        get_user_model().objects.create_user(
+            'reader', email='reader@example.com', password='secret'
+        )
+        self.client.post(
+            reverse('users:password_reset'),
+            {'email': 'reader@example.com'},
+        )
+        self.assertEqual(django_mail.outbox, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.recipients, 'reader@example.com')
+        output = StringIO()
+        call_command('send_outbox', burst=True, stdout=output)
+        self.assertIn('Отправлено писем: 1', output.getvalue())
+        self.assertEqual(django_mail.outbox[0].to, ['reader@example.com'])
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_signup_queues_welcome_mail(self):
+        self.client.post(reverse('users:signup'), {
+            'username': 'newcomer',
+            'email': 'newcomer@example.com',
+            'password1': 'Str0ng-passw0rd',
+            'password2': 'Str0ng-passw0rd',
+        })
+        mail.drain(10, burst=True)
+        self.assertEqual(len(django_mail.outbox), 1)
+        self.assertIn('newcomer', django_mail.outbox[0].body)
+
+    def test_mail_in_rolled_back_transaction_dropped(self):
+        try:
+            with transaction.atomic():
+                django_mail.send_mail('Тема', 'Текст', None, ['a@b.c'])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_delivery_retried_then_dead(self):
+        django_mail.send_mail('Тема', 'Текст', None, ['a@b.c'])
+        with mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages',
+            side_effect=OSError('Сервер недоступен'),
+        ):
+            self.assertEqual(mail.drain(10, burst=True), 0)
+            email = OutboxEmail.objects.get()
+            self.assertEqual((email.status, email.attempts), (
+                OutboxEmail.QUEUED, 1
+            ))
+            self.assertGreater(email.send_after, timezone.now())
+            self.assertEqual(mail.claim(10), [])
+            OutboxEmail.objects.update(send_after=timezone.now())
+            mail.drain(10, burst=True)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.DEAD)
+        self.assertIn('Сервер недоступен', email.last_error)
+        self.assertEqual(mail.drain(10, burst=True), 0)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=1)
+    def test_mail_of_dead_sender_dead_after_max_attempts(self):
+        django_mail.send_mail('Тема', 'Текст', None, ['a@b.c'])
+        self.assertEqual(len(mail.claim(10)), 1)
+        OutboxEmail.objects.update(
+            locked_until=timezone.now() - timedelta(1)
+        )
+        self.assertEqual(mail.claim(10), [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (
+            OutboxEmail.DEAD, 1
+        ))
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def wrapper(self, **options):
+        wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': os.path.join(self.directory.name, 'db.sqlite3'),
+            'OPTIONS': options,
+        })
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_on_connect(self):
+        wrapper = self.wrapper(pragmas={'cache_size': -1024})
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'temp_store'), 2)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -1024)
+
+    def test_immediate_transaction_takes_write_lock(self):
+        wrapper = self.wrapper(transaction_mode='immediate')
+        other = self.wrapper(timeout=0)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (id INTEGER)')
+        wrapper._start_transaction_under_autocommit()
+        with self.assertRaisesMessage(OperationalError, 'locked'):
+            with other.cursor() as cursor:
+                cursor.execute('INSERT INTO t VALUES (1)')
+        with wrapper.cursor() as cursor:
+            cursor.execute('ROLLBACK')
+
+    def test_unknown_transaction_mode_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.wrapper(transaction_mode='later').ensure_connection()
+
+
+@override_settings(WRITE_BATCH_WINDOW=0.2, WRITE_MAX_ATTEMPTS=2)
+class WriteLaneTest(TransactionTestCase):
+    def setUp(self):
+        self.lane = writes.WriteLane()
+        self.batches = []
+        write = self.lane._write
+
+        def record_batch(batch):
+            self.batches.append(len(batch))
+            return write(batch)
+
+        self.lane._write = record_batch
+
+    def test_close_writes_grouped_into_one_transaction(self):
+        futures = [
+            self.lane.submit(store, (f'file{i}',), {}) for i in range(5)
+        ]
+        futures.append(self.lane.submit(store, ('file0',), {}))
+        ids = [future.result(timeout=5) for future in futures[:5]]
+        with self.assertRaises(IntegrityError):
+            futures[-1].result(timeout=5)
+        self.assertEqual(self.batches, [6])
+        self.assertEqual(
+            sorted(StoredFile.objects.values_list('pk', flat=True)),
+            sorted(ids),
+        )
+
+    def test_failed_begin_retried_then_reported(self):
+        with mock.patch(
+            'core.backends.sqlite3.base.DatabaseWrapper.'
+            '_start_transaction_under_autocommit',
+            side_effect=OperationalError('locked'),
+        ) as begin, mock.patch('core.writes.time.sleep'):
+            future = self.lane.submit(store, ('file',), {})
+            with self.assertRaises(OperationalError):
+                future.result(timeout=5)
+        self.assertEqual(begin.call_count, 2)
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertEqual(self.lane.submit(store, ('file',), {}).result(
+            timeout=5
+        ), StoredFile.objects.get().pk)
+
+    def test_failure_after_writes_not_retried(self):
+        calls = []
+
+        def write():
+            calls.append(store('file'))
+            transaction.on_commit(
+                mock.Mock(side_effect=OperationalError('disk I/O error'))
+            )
+
+        future = self.lane.submit(write, (), {})
+        with self.assertRaises(OperationalError):
+            future.result(timeout=5)
+        self.assertEqual(len(calls), 1)
+
+    def test_run_inside_transaction_writes_in_place(self):
+        with mock.patch.object(writes.lane, 'submit') as submit:
+            with transaction.atomic():
+                writes.run(store, 'inline')
+            self.assertFalse(submit.called)
+        self.assertTrue(StoredFile.objects.filter(name='inline').exists())
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http.multipartparser import MultiPartParser
+
+
+class RejectedUpload(UploadedFile):
+    """Файл, приём которого прерван из-за превышения размера.
+
+    Содержимого у него нет, `size` — сколько байт успело прийти.
+    """
+
+    def __init__(self, name, content_type, size):
+        super().__init__(None, name, content_type, size)
+
+    def open(self, mode=None):
+        raise ValueError('Файл не был принят целиком')
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Прерывает приём запроса, как только файл превышает лимит.
+
+    Должен стоять первым в FILE_UPLOAD_HANDLERS. Если по
+    `content_length` файл может оказаться больше
+    FILE_UPLOAD_MAX_SIZE, обработчик сам разбирает тело запроса и
+    на первом лишнем байте файла бросает
+    `StopUpload(connection_reset=True)`: остаток тела не читается,
+    а вместо файла в `request.FILES` попадает `RejectedUpload`.
+    Поля формы, пришедшие до файла, сохраняются.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.parsing = False
+        self.rejected = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        if self.parsing or content_length <= settings.FILE_UPLOAD_MAX_SIZE:
+            return None
+        self.parsing = True
+        parser = MultiPartParser(
+            META, input_data, self.request.upload_handlers, encoding
+        )
+        post, files = parser.parse()
+        if self.rejected is not None:
+            files.appendlist(self.field_name, self.rejected)
+        return post, files
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.FILE_UPLOAD_MAX_SIZE:
+            self.rejected = RejectedUpload(
+                self.file_name, self.content_type, self.received
+            )
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
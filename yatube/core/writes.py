@@ -0,0 +1,143 @@
+import fcntl
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import (OperationalError, close_old_connections, connection,
+                       transaction)
+
+from core import replica
+
+logger = logging.getLogger(__name__)
+
+
+class WriteLane:
+    """Очередь записей процесса с единственным потоком-писателем.
+
+    Записи, пришедшие в пределах WRITE_BATCH_WINDOW секунд друг от
+    друга, выполняются одной транзакцией (до WRITE_BATCH_SIZE штук),
+    каждая в своей точке сохранения: ошибка одной записи не отменяет
+    остальные. Писатели разных процессов по очереди берут блокировку
+    файла WRITE_LOCK_FILE, поэтому не ждут друг друга внутри SQLite.
+    Если транзакцию не удалось начать, попытка повторяется, всего
+    не больше WRITE_MAX_ATTEMPTS раз. Ошибка после того, как записи
+    выполнились (например, при фиксации), возвращается всей пачке:
+    записи не идемпотентны и повторять их после отката нельзя.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._lock_file = None
+
+    def submit(self, func, args, kwargs):
+        future = Future()
+        self._start().put((future, func, args, kwargs))
+        return future
+
+    def _start(self):
+        # После fork потока-писателя в дочернем процессе нет.
+        with self._guard:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.SimpleQueue()
+                self._lock_file = None
+                threading.Thread(
+                    target=self._serve,
+                    args=(self._queue,),
+                    name='write-lane',
+                    daemon=True,
+                ).start()
+            return self._queue
+
+    @contextmanager
+    def _locked(self):
+        if self._lock_file is None:
+            self._lock_file = open(settings.WRITE_LOCK_FILE, 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _collect(self, pending):
+        batch = [pending.get()]
+        deadline = time.monotonic() + settings.WRITE_BATCH_WINDOW
+        while len(batch) < settings.WRITE_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self, pending):
+        while True:
+            batch = self._collect(pending)
+            close_old_connections()
+            try:
+                outcomes = self._write(batch)
+            except Exception as error:
+                logger.exception('Не удалось записать пачку из %s', len(batch))
+                outcomes = [(future, error, None) for future, *_ in batch]
+            for future, error, result in outcomes:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def _write(self, batch):
+        # Блокировка держится на всех попытках: иначе между ними
+        # в базу успел бы писать другой процесс.
+        with self._locked():
+            for attempt in range(1, settings.WRITE_MAX_ATTEMPTS + 1):
+                outcomes = []
+                try:
+                    with transaction.atomic():
+                        for future, func, args, kwargs in batch:
+                            try:
+                                with transaction.atomic():
+                                    result = func(*args, **kwargs)
+                            except Exception as error:
+                                outcomes.append((future, error, None))
+                            else:
+                                outcomes.append((future, None, result))
+                    return outcomes
+                except OperationalError:
+                    # После отката записи повторять нельзя: они уже
+                    # сохранили файлы и поменяли объекты в памяти.
+                    if outcomes or attempt == settings.WRITE_MAX_ATTEMPTS:
+                        raise
+                    logger.warning(
+                        'Повтор начала пачки записей, попытка %s', attempt
+                    )
+                    time.sleep(0.05 * 2 ** attempt * random.uniform(1, 1.5))
+
+
+lane = WriteLane()
+
+
+def run(func, *args, **kwargs):
+    """Выполнить запись `func(*args, **kwargs)` и вернуть её результат.
+
+    Запись уходит в очередь процесса и выполняется в потоке-писателе
+    вместе с соседними. Внутри уже открытой транзакции, а также при
+    выключенном WRITE_QUEUE функция выполняется на месте. После
+    записи пользователь запроса читает из основной базы.
+    """
+    if not settings.WRITE_QUEUE or connection.in_atomic_block:
+        with transaction.atomic():
+            result = func(*args, **kwargs)
+    else:
+        result = lane.submit(func, args, kwargs).result()
+    replica.record_write()
+    return result
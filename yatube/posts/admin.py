@@ -1,8 +1,25 @@
 from django.contrib import admin
 
+from posts import export
 from posts.models import Group, Post, Comment, Follow
 
 
+def export_ndjson(modeladmin, request, queryset):
+    return export.response(
+        queryset, 'ndjson', queryset.model._meta.model_name
+    )
+
+
+export_ndjson.short_description = 'Выгрузить выбранные в NDJSON'
+
+
+def export_csv(modeladmin, request, queryset):
+    return export.response(queryset, 'csv', queryset.model._meta.model_name)
+
+
+export_csv.short_description = 'Выгрузить выбранные в CSV'
+
+
 class PostAdmin(admin.ModelAdmin):
     list_display = (
         'pk',
@@ -15,6 +32,7 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     list_editable = ('group',)
     empty_value_display = '-пусто-'
+    actions = (export_ndjson, export_csv)
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -38,6 +56,7 @@ class CommentAdmin(admin.ModelAdmin):
     search_fields = ('post', 'author', 'text',)
     list_filter = ('created',)
     empty_value_display = '-пусто-'
+    actions = (export_ndjson, export_csv)
 
 
 class FollowAdmin(admin.ModelAdmin):
@@ -49,6 +68,7 @@ class FollowAdmin(admin.ModelAdmin):
     search_fields = ('user', 'author',)
     list_filter = ('user', 'author',)
     empty_value_display = '-пусто-'
+    actions = (export_ndjson, export_csv)
 
 
 admin.site.register(Post, PostAdmin)
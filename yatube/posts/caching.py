@@ -0,0 +1,79 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import replica
+
+FEED_VERSION_KEY = 'posts:feed_version'
+USER_VERSION_KEY = 'posts:user_version:{}'
+
+
+def _version(key):
+    """Текущая версия по ключу `key` для ключей кеша и ETag.
+
+    Начальное значение берётся из времени, чтобы после вытеснения
+    ключа из кеша версия не вернулась к уже использованной.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _version(key)
+
+
+def feed_version():
+    return _version(FEED_VERSION_KEY)
+
+
+def bump_feed_version():
+    _bump(FEED_VERSION_KEY)
+
+
+def user_version(user_id):
+    return _version(USER_VERSION_KEY.format(user_id))
+
+
+def bump_user_version(user_id):
+    _bump(USER_VERSION_KEY.format(user_id))
+
+
+def feed_cache_context():
+    return {
+        'feed_version': feed_version(),
+        'feed_database': replica.read_alias(),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+    }
+
+
+def page_etag(request, *args, **kwargs):
+    """ETag страниц лент и поста без рендеринга и запросов к постам.
+
+    Страница зависит от общего содержимого (версия лент), от того,
+    кто смотрит, и от его подписок (версия пользователя). Страница
+    вошедшего пользователя несёт CSRF-токен, поэтому её ETag
+    меняется вместе с сессией и CSRF-cookie.
+    """
+    user_id = request.user.pk
+    parts = [
+        request.get_full_path(),
+        feed_version(),
+        user_id,
+        user_version(user_id) if user_id else None,
+    ]
+    if user_id:
+        parts += [
+            request.session.session_key,
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        ]
+    return hashlib.md5(
+        ':'.join(map(str, parts)).encode()
+    ).hexdigest()
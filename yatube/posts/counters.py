@@ -0,0 +1,128 @@
+from core.models import StoredFile
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.db.models import Count, F
+
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+
+def _add(queryset, **deltas):
+    return queryset.update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+def _actual(queryset, field, ids):
+    return dict(
+        queryset.filter(**{f'{field}__in': ids})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values_list(field, 'total')
+    )
+
+
+def _drifted(rows, key, counts):
+    changed = []
+    for row in rows:
+        dirty = False
+        for field, actual in counts.items():
+            value = actual.get(getattr(row, key), 0)
+            if getattr(row, field) != value:
+                setattr(row, field, value)
+                dirty = True
+        if dirty:
+            changed.append(row)
+    return changed
+
+
+def add_to_user(user_id, **deltas):
+    _add(UserStats.objects.filter(user_id=user_id), **deltas)
+
+
+def add_to_group(group_id, delta):
+    if group_id is not None:
+        _add(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def add_to_post(post_id, delta):
+    _add(Post.objects.filter(pk=post_id), comments_count=delta)
+
+
+def stats_for(user):
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        reconcile_users([user.pk])
+        # Только что созданной строки в реплике ещё может не быть.
+        return UserStats.objects.using(
+            router.db_for_write(UserStats)
+        ).get(user=user)
+
+
+def reconcile_users(ids):
+    """Пересчитать счётчики пользователей `ids`, вернуть число правок."""
+    counts = {
+        'posts_count': _actual(Post.objects, 'author_id', ids),
+        'followers_count': _actual(Follow.objects, 'author_id', ids),
+        'following_count': _actual(Follow.objects, 'user_id', ids),
+    }
+    rows = list(UserStats.objects.filter(user_id__in=ids))
+    changed = _drifted(rows, 'user_id', counts)
+    UserStats.objects.bulk_update(changed, list(counts))
+    known = {row.user_id for row in rows}
+    missing = [
+        UserStats(
+            user_id=user_id,
+            **{field: actual.get(user_id, 0)
+               for field, actual in counts.items()}
+        )
+        for user_id in User.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True
+        )
+        if user_id not in known
+    ]
+    UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+    return len(changed) + len(missing)
+
+
+def reconcile_groups(ids):
+    counts = {'posts_count': _actual(Post.objects, 'group_id', ids)}
+    changed = _drifted(Group.objects.filter(pk__in=ids), 'pk', counts)
+    Group.objects.bulk_update(changed, list(counts))
+    return len(changed)
+
+
+def reconcile_posts(ids):
+    counts = {'comments_count': _actual(Comment.objects, 'post_id', ids)}
+    changed = _drifted(Post.objects.filter(pk__in=ids), 'pk', counts)
+    Post.objects.bulk_update(changed, list(counts))
+    return len(changed)
+
+
+def reconcile_images(ids):
+    """Пересчитать ссылки на картинки постов `ids`, вернуть число правок.
+
+    Ссылки считаются по всем постам, а не только по `ids`: одна
+    картинка может принадлежать нескольким постам.
+    """
+    names = set(
+        Post.objects.filter(pk__in=ids).exclude(image='').exclude(
+            image__isnull=True
+        ).values_list('image', flat=True)
+    )
+    if not names:
+        return 0
+    counts = {'references': _actual(Post.objects, 'image', names)}
+    rows = list(StoredFile.objects.filter(name__in=names))
+    changed = _drifted(rows, 'name', counts)
+    StoredFile.objects.bulk_update(changed, list(counts))
+    known = {row.name for row in rows}
+    missing = [
+        StoredFile(name=name, references=counts['references'][name])
+        for name in names - known
+    ]
+    StoredFile.objects.bulk_create(missing, ignore_conflicts=True)
+    return len(changed) + len(missing)
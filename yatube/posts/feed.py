@@ -0,0 +1,117 @@
+from operator import attrgetter
+
+from core import jobs
+from django.conf import settings
+
+from posts.models import Follow, Post, TimelineEntry, UserStats
+from posts.pagination import CursorPaginator, MergedCursorPaginator
+
+BATCH_SIZE = 500
+
+
+def feed_posts(posts=None):
+    """Посты для ленты вместе с авторами и группами одним запросом."""
+    if posts is None:
+        posts = Post.objects.all()
+    return posts.select_related('author', 'group')
+
+
+def is_celebrity(author_id):
+    return UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gte=settings.FEED_CELEBRITY_THRESHOLD,
+    ).exists()
+
+
+def celebrities_followed_by(user):
+    return Follow.objects.filter(
+        user=user,
+        author__stats__followers_count__gte=settings.FEED_CELEBRITY_THRESHOLD,
+    ).values_list('author_id', flat=True)
+
+
+def push_post(post):
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post) for user_id in followers),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    if is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).values_list('pk', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk) for pk in posts),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id,
+        post__author_id=author_id,
+    ).delete()
+
+
+def followers_changed(author_id, delta):
+    """Перестроить входящие подписчиков, если автор пересёк порог.
+
+    Посты автора ниже FEED_CELEBRITY_THRESHOLD лежат во входящих, а
+    выше — подтягиваются при чтении. При переходе через порог посты,
+    написанные до него, нужно перенести, иначе после понижения они
+    пропадут из лент до `rebuild_timelines`.
+    """
+    threshold = settings.FEED_CELEBRITY_THRESHOLD
+    followers = UserStats.objects.filter(user_id=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if followers == (threshold if delta > 0 else threshold - 1):
+        jobs.enqueue(reclassify, author_id, priority=-10)
+
+
+def reclassify(author_id):
+    """Привести входящие подписчиков автора к его текущему статусу."""
+    if is_celebrity(author_id):
+        TimelineEntry.objects.filter(post__author_id=author_id).delete()
+        return
+    followers = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    for user_id in followers.iterator():
+        backfill(user_id, author_id)
+
+
+def follow_paginator(user, per_page):
+    """Лента подписок: посты обычных авторов лежат во входящих,
+    посты авторов с числом подписчиков от FEED_CELEBRITY_THRESHOLD
+    подтягиваются при чтении и сливаются с ними по `pk`. Каждый
+    такой автор — отдельный источник: выборка по одному автору идёт
+    по индексу `(author, -id)` без сортировки, а по списку авторов
+    потребовала бы сортировать все их посты.
+    """
+    inbox = CursorPaginator(
+        TimelineEntry.objects.filter(user=user).select_related(
+            'post__author', 'post__group'
+        ),
+        per_page,
+        key='post_id',
+        transform=attrgetter('post'),
+    )
+    celebrities = list(celebrities_followed_by(user))
+    if not celebrities:
+        return inbox
+    pulled = [
+        CursorPaginator(feed_posts().filter(author_id=author_id), per_page)
+        for author_id in celebrities
+    ]
+    return MergedCursorPaginator([inbox, *pulled], per_page)
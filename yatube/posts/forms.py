@@ -1,4 +1,12 @@
+import os
+
+from core.images import normalize
+from core.uploads import RejectedUpload
 from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from django.template.defaultfilters import filesizeformat
+from posts.images import EXTENSIONS
 from posts.models import Post, Comment
 
 
@@ -7,6 +15,50 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rejected_image = self.files.get('image')
+        if isinstance(self.rejected_image, RejectedUpload):
+            self.files = self.files.copy()
+            del self.files['image']
+        else:
+            self.rejected_image = None
+
+    def clean_image(self):
+        if self.rejected_image is not None:
+            raise forms.ValidationError(
+                'Файл больше %(limit)s.',
+                code='file_too_large',
+                params={
+                    'limit': filesizeformat(settings.FILE_UPLOAD_MAX_SIZE)
+                },
+            )
+        image = self.cleaned_data['image']
+        if not isinstance(image, UploadedFile):
+            return image
+        width, height = image.image.size
+        if width * height > settings.POST_IMAGE_MAX_PIXELS:
+            raise forms.ValidationError(
+                'Слишком большое разрешение: %(width)s×%(height)s.',
+                code='too_many_pixels',
+                params={'width': width, 'height': height},
+            )
+        image.seek(0)
+        normalized = normalize(
+            image,
+            settings.POST_IMAGE_MAX_DIMENSION,
+            settings.POST_IMAGE_QUALITY,
+        )
+        if normalized is None:
+            image.seek(0)
+            return image
+        image_format, content = normalized
+        extension = EXTENSIONS.get(image_format, image_format.lower())
+        name = f'{os.path.splitext(image.name)[0]}.{extension}'
+        return SimpleUploadedFile(
+            name, content, content_type=f'image/{image_format.lower()}'
+        )
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,169 @@
+import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from core import jobs
+from core.images import describe, render
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from sorl.thumbnail import delete as delete_thumbnails
+
+from posts import caching
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'posts/variants/'
+EXTENSIONS = {'JPEG': 'jpg'}
+EMPTY_FIELDS = {
+    'image_variants': '',
+    'image_width': None,
+    'image_height': None,
+    'image_size': None,
+    'image_hash': '',
+    'image_placeholder': '',
+}
+
+_processes = None
+_lock = threading.Lock()
+
+
+def _render_options():
+    return (
+        settings.POST_IMAGE_WIDTHS,
+        settings.POST_IMAGE_RATIO,
+        settings.POST_IMAGE_FORMATS,
+        settings.POST_IMAGE_QUALITY,
+    )
+
+
+def variant_name(name, width, image_format):
+    """Имя варианта картинки `name` шириной `width`.
+
+    В имя входит полное имя оригинала с расширением: у `cat.jpg`
+    и `cat.png` варианты свои, и по варианту оригинал находится
+    точным сравнением (`variant_source`).
+    """
+    extension = EXTENSIONS.get(image_format, image_format.lower())
+    return f'{VARIANTS_DIR}{name}-{width}w.{extension}'
+
+
+def variant_source(variant):
+    """Имя оригинала, из которого нарезан вариант `variant`."""
+    return variant[len(VARIANTS_DIR):].rsplit('-', 1)[0]
+
+
+def save_variants(name, rendered):
+    """Сохранить нарезанные варианты `name` и описать их для шаблона.
+
+    Последний формат из POST_IMAGE_FORMATS идёт в `<img>`, остальные —
+    в `<source>` элемента `<picture>`.
+    """
+    srcsets = {}
+    variants = {'width': 0}
+    for image_format, width, height, content in rendered:
+        target = variant_name(name, width, image_format)
+        default_storage.delete(target)
+        url = default_storage.url(
+            default_storage.save(target, ContentFile(content))
+        )
+        srcsets.setdefault(image_format, []).append(f'{url} {width}w')
+        if width >= variants['width']:
+            variants.update(src=url, width=width, height=height)
+    *sources, fallback = srcsets
+    variants['srcset'] = ', '.join(srcsets[fallback])
+    variants['sources'] = [
+        {'type': f'image/{image_format.lower()}',
+         'srcset': ', '.join(srcsets[image_format])}
+        for image_format in sources
+    ]
+    return variants
+
+
+def metadata_fields(metadata):
+    return {
+        'image_width': metadata['width'],
+        'image_height': metadata['height'],
+        'image_size': metadata['size'],
+        'image_hash': metadata['hash'],
+        'image_placeholder': metadata['placeholder'],
+    }
+
+
+def variant_names(name):
+    return [
+        variant_name(name, width, image_format)
+        for width in settings.POST_IMAGE_WIDTHS
+        for image_format in settings.POST_IMAGE_FORMATS
+    ]
+
+
+def delete_derived(name):
+    """Удалить варианты и миниатюры картинки, на которую нет ссылок."""
+    if Post.objects.filter(image=name).exists():
+        return
+    try:
+        delete_thumbnails(name, delete_file=False)
+        for variant in variant_names(name):
+            default_storage.delete(variant)
+    except Exception:
+        logger.exception('Не удалось удалить копии картинки %s', name)
+
+
+def release(name):
+    """Снять ссылку поста на картинку и убрать оставшееся без ссылок.
+
+    Сам файл удаляет хранилище после фиксации транзакции, а варианты
+    и миниатюры — фоновая задача, которая ставится в той же
+    транзакции, так что откат ничего не теряет. Что не удалось
+    убрать здесь, найдёт `collect_media_garbage`.
+    """
+    Post.image.field.storage.delete(name)
+    jobs.enqueue(delete_derived, name, priority=10)
+
+
+def read(name):
+    with default_storage.open(name) as source:
+        return source.read()
+
+
+def metadata_for(name):
+    """Описать картинку в текущем процессе: поля поста без вариантов."""
+    return metadata_fields(
+        describe(read(name), settings.POST_IMAGE_PLACEHOLDER_WIDTH)
+    )
+
+
+def variants_for(name):
+    """Нарезать и сохранить варианты картинки в текущем процессе."""
+    return save_variants(name, render(read(name), *_render_options()))
+
+
+def store(post_id, name, **fields):
+    """Записать поля посту, если его картинка с тех пор не менялась."""
+    return Post.objects.filter(pk=post_id, image=name).update(**fields)
+
+
+def build(post_id, name):
+    """Описать картинку поста и создать её варианты в пуле процессов."""
+    global _processes
+    with _lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                mp_context=get_context('spawn'),
+            )
+    data = read(name)
+    rendered = _processes.submit(render, data, *_render_options())
+    described = _processes.submit(
+        describe, data, settings.POST_IMAGE_PLACEHOLDER_WIDTH
+    )
+    fields = metadata_fields(described.result())
+    fields['image_variants'] = json.dumps(
+        save_variants(name, rendered.result())
+    )
+    if store(post_id, name, **fields):
+        caching.bump_feed_version()
@@ -0,0 +1,53 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import caching, images
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет размеры, объём, хеш и превью картинок у постов, '
+        'для которых они ещё не сохранены'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Сколько постов обрабатывать за одну транзакцию',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).filter(image_hash='').order_by('pk').values_list('pk', 'image')
+        done = failed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_pk)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                for pk, name in batch:
+                    try:
+                        fields = images.metadata_for(name)
+                    except Exception:
+                        logger.exception(
+                            'Не удалось описать картинку %s', name
+                        )
+                        failed += 1
+                        continue
+                    done += images.store(pk, name, **fields)
+            last_pk = batch[-1][0]
+        caching.bump_feed_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Описано картинок: {done}, с ошибками: {failed}'
+        ))
@@ -0,0 +1,242 @@
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from io import StringIO
+from multiprocessing import get_context
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts.models import Group, Post
+
+User = get_user_model()
+
+# Поведение стокового бэкенда: журнал отката, настройки SQLite по
+# умолчанию и новое соединение на каждый запрос.
+BASELINE = {
+    'CONN_MAX_AGE': 0,
+    'OPTIONS': {
+        'timeout': 5,
+        'transaction_mode': 'DEFERRED',
+        'pragmas': {
+            'journal_mode': 'DELETE',
+            'synchronous': 'FULL',
+            'mmap_size': 0,
+            'cache_size': -2000,
+            'temp_store': 'DEFAULT',
+        },
+    },
+}
+
+
+def percentile(values, fraction):
+    """Процентиль `values` методом ближайшего ранга (`fraction` от 0 до 1).
+
+    statistics.quantiles появился только в Python 3.8.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет пропускную способность чтения страниц, пока другие '
+        'процессы создают посты, комментарии и подписки, на временной базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Число читающих процессов',
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=2,
+            help='Число пишущих процессов',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Длительность замера в секундах',
+        )
+        parser.add_argument(
+            '--posts',
+            type=int,
+            default=2000,
+            help='Сколько постов создать перед замером',
+        )
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help='Повторить замер с настройками стокового бэкенда',
+        )
+
+    def seed(self, posts):
+        User.objects.bulk_create(
+            User(username=f'author{i}') for i in range(20)
+        )
+        authors = list(User.objects.all())
+        Group.objects.bulk_create(
+            Group(title=f'Группа {i}', slug=f'group-{i}', description='')
+            for i in range(10)
+        )
+        groups = list(Group.objects.all())
+        Post.objects.bulk_create(
+            (
+                Post(
+                    text=f'Пост {i}',
+                    author=authors[i % len(authors)],
+                    group=groups[i % len(groups)],
+                )
+                for i in range(posts)
+            ),
+            batch_size=500,
+        )
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def read(self, deadline, results):
+        client = Client()
+        authors = list(User.objects.values_list('username', flat=True))
+        post_ids = list(Post.objects.values_list('pk', flat=True)[:500])
+        pages = (
+            lambda: reverse('posts:index'),
+            lambda: reverse('posts:group_posts', kwargs={
+                'slug': f'group-{random.randrange(10)}'
+            }),
+            lambda: reverse('posts:profile', kwargs={
+                'username': random.choice(authors)
+            }),
+            lambda: reverse('posts:post_detail', kwargs={
+                'post_id': random.choice(post_ids)
+            }),
+        )
+        self.loop(deadline, results, 'read', lambda: client.get(
+            random.choice(pages)()
+        ))
+
+    def write(self, deadline, results):
+        client = Client()
+        client.force_login(User.objects.order_by('?').first())
+        post_ids = list(Post.objects.values_list('pk', flat=True)[:500])
+        authors = list(User.objects.values_list('username', flat=True))
+
+        def request():
+            kind = random.random()
+            if kind < 0.4:
+                return client.post(
+                    reverse('posts:post_create'), {'text': 'Новый пост'}
+                )
+            if kind < 0.8:
+                return client.post(
+                    reverse('posts:add_comment', kwargs={
+                        'post_id': random.choice(post_ids)
+                    }),
+                    {'text': 'Новый комментарий'},
+                )
+            return client.get(reverse(
+                random.choice(('posts:profile_follow',
+                               'posts:profile_unfollow')),
+                kwargs={'username': random.choice(authors)},
+            ))
+
+        self.loop(deadline, results, 'write', request)
+
+    def loop(self, deadline, results, kind, request):
+        latencies = []
+        errors = 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                request()
+            except DatabaseError:
+                errors += 1
+            else:
+                latencies.append(time.monotonic() - started)
+            # Как сервер: соединение закрывается после ответа, если
+            # CONN_MAX_AGE не разрешает его переиспользовать.
+            close_old_connections()
+        connections.close_all()
+        results.put((kind, latencies, errors))
+
+    def run(self, options, profile=None):
+        directory = tempfile.mkdtemp(prefix='yatube-benchmark-')
+        settings_dict = connections['default'].settings_dict
+        original = dict(settings_dict)
+        connections.close_all()
+        settings_dict['NAME'] = os.path.join(directory, 'db.sqlite3')
+        settings_dict.update(profile or {})
+        caches = {'default': {
+            'BACKEND': 'core.cache.SharedMemoryCache',
+            'LOCATION': os.path.join(directory, 'cache'),
+        }}
+        try:
+            with override_settings(CACHES=caches):
+                call_command('migrate', verbosity=0)
+                self.seed(options['posts'])
+                connections.close_all()
+                return self.measure(options)
+        finally:
+            connections.close_all()
+            settings_dict.clear()
+            settings_dict.update(original)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def workers(self, options):
+        return (
+            (self.read, options['readers']),
+            (self.write, options['writers']),
+        )
+
+    def measure(self, options):
+        context = get_context('fork')
+        results = context.Queue()
+        deadline = time.monotonic() + options['duration']
+        processes = [
+            context.Process(target=target, args=(deadline, results))
+            for target, count in self.workers(options)
+            for _ in range(count)
+        ]
+        for process in processes:
+            process.start()
+        totals = {'read': ([], 0), 'write': ([], 0)}
+        for _ in processes:
+            kind, latencies, errors = results.get()
+            done, failed = totals[kind]
+            totals[kind] = (done + latencies, failed + errors)
+        for process in processes:
+            process.join()
+        return totals
+
+    def report(self, label, totals, duration):
+        self.stdout.write(label)
+        for kind, title in (('read', 'Чтение'), ('write', 'Запись')):
+            latencies, errors = totals[kind]
+            p95 = percentile(latencies, 0.95) * 1000
+            self.stdout.write(
+                f'  {title}: {len(latencies) / duration:.1f} запр./с, '
+                f'p95 {p95:.1f} мс, ошибок {errors}'
+            )
+
+    def handle(self, *args, **options):
+        duration = options['duration']
+        self.report(
+            'Текущие настройки базы', self.run(options), duration
+        )
+        if options['compare']:
+            self.report(
+                'Стоковый бэкенд', self.run(options, BASELINE), duration
+            )
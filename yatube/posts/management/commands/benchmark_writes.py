@@ -0,0 +1,83 @@
+import queue
+import threading
+
+from django.test.utils import override_settings
+
+from posts.management.commands.benchmark_database import (
+    Command as DatabaseBenchmark, percentile
+)
+
+
+class Command(DatabaseBenchmark):
+    help = (
+        'Измеряет скорость и задержки записи постов, комментариев и '
+        'подписок с очередью записей и без неё на временной базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=2,
+            help='Число пишущих процессов',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Число потоков-клиентов в каждом процессе',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Длительность замера в секундах',
+        )
+        parser.add_argument(
+            '--posts',
+            type=int,
+            default=2000,
+            help='Сколько постов создать перед замером',
+        )
+
+    def write_in_threads(self, deadline, results):
+        collected = queue.SimpleQueue()
+        threads = [
+            threading.Thread(target=self.write, args=(deadline, collected))
+            for _ in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies, errors = [], 0
+        while not collected.empty():
+            _, done, failed = collected.get()
+            latencies += done
+            errors += failed
+        results.put(('write', latencies, errors))
+
+    def workers(self, options):
+        return ((self.write_in_threads, options['processes']),)
+
+    def report(self, label, totals, duration):
+        latencies, errors = totals['write']
+        p50, p95, p99 = (
+            percentile(latencies, fraction) * 1000
+            for fraction in (0.5, 0.95, 0.99)
+        )
+        self.stdout.write(
+            f'{label}: {len(latencies) / duration:.1f} записей/с, '
+            f'p50 {p50:.1f} мс, p95 {p95:.1f} мс, p99 {p99:.1f} мс, '
+            f'ошибок {errors}'
+        )
+
+    def handle(self, *args, **options):
+        self.threads = options['threads']
+        for label, enabled in (
+            ('С очередью записей', True),
+            ('Без очереди записей', False),
+        ):
+            with override_settings(WRITE_QUEUE=enabled):
+                totals = self.run(options)
+            self.report(label, totals, options['duration'])
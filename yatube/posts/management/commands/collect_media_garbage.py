@@ -0,0 +1,194 @@
+import posixpath
+from datetime import timedelta
+
+from core.models import StoredFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts import images
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки постов, их варианты и миниатюры, на которые '
+        'больше ничто не ссылается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько файлов или записей проверять за раз',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд',
+        )
+
+    def walk(self, storage, path):
+        if not storage.exists(path):
+            return
+        directories, files = storage.listdir(path)
+        for name in files:
+            yield posixpath.join(path, name)
+        for directory in directories:
+            yield from self.walk(storage, posixpath.join(path, directory))
+
+    def old_files(self, storage, path, skip=None):
+        """Файлы каталога `path` старше --min-age пачками по --batch-size."""
+        batch = []
+        for name in self.walk(storage, path):
+            if skip and name.startswith(skip):
+                continue
+            if storage.get_modified_time(name) > self.cutoff:
+                continue
+            batch.append(name)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def report(self, label, storage, names):
+        size = sum(storage.size(name) for name in names)
+        self.totals[label] = [
+            total + value
+            for total, value in zip(self.totals[label], (len(names), size))
+        ]
+        if self.verbosity > 1:
+            for name in names:
+                self.stdout.write(f'  {name}')
+
+    def collect_originals(self):
+        storage = Post.image.field.storage
+        directory = posixpath.dirname(Post.image.field.upload_to)
+        for batch in self.old_files(
+            storage, directory, skip=images.VARIANTS_DIR
+        ):
+            used = set(
+                Post.objects.filter(image__in=batch).values_list(
+                    'image', flat=True
+                )
+            )
+            # Повторная загрузка того же содержимого не переписывает
+            # файл: он старый, но на него уже ссылается новый пост.
+            used.update(
+                StoredFile.objects.filter(
+                    name__in=batch, references__gt=0
+                ).values_list('name', flat=True)
+            )
+            unused = [name for name in batch if name not in used]
+            self.report('картинок', storage, unused)
+            if self.dry_run or not unused:
+                continue
+            for name in unused:
+                if storage.purge(name):
+                    images.delete_derived(name)
+
+    def collect_variants(self):
+        directory = images.VARIANTS_DIR.rstrip('/')
+        for batch in self.old_files(default_storage, directory):
+            sources = {name: images.variant_source(name) for name in batch}
+            used = set(
+                Post.objects.filter(
+                    image__in=set(sources.values())
+                ).values_list('image', flat=True)
+            )
+            unused = [
+                name for name, source in sources.items()
+                if source not in used
+            ]
+            self.report('вариантов', default_storage, unused)
+            if not self.dry_run:
+                for name in unused:
+                    default_storage.delete(name)
+
+    def collect_thumbnail_sources(self):
+        rows = KVStore.objects.filter(
+            key__startswith=add_prefix('')
+        ).order_by('key')
+        last_key = ''
+        while True:
+            batch = list(
+                rows.filter(key__gt=last_key).values_list('key', 'value')[
+                    :self.batch_size
+                ]
+            )
+            if not batch:
+                return
+            last_key = batch[-1][0]
+            sources = {
+                deserialize_image_file(value).name for _, value in batch
+            }
+            sources = {
+                name for name in sources
+                if not name.startswith(sorl_settings.THUMBNAIL_PREFIX)
+            }
+            used = set(
+                Post.objects.filter(image__in=sources).values_list(
+                    'image', flat=True
+                )
+            )
+            unused = sources - used
+            self.totals['источников миниатюр'][0] += len(unused)
+            if not self.dry_run:
+                for name in unused:
+                    delete_thumbnails(name, delete_file=False)
+
+    def collect_thumbnail_files(self):
+        storage = default.storage
+        directory = sorl_settings.THUMBNAIL_PREFIX.rstrip('/')
+        for batch in self.old_files(storage, directory):
+            keys = {
+                add_prefix(ImageFile(name, storage).key): name
+                for name in batch
+            }
+            known = set(
+                KVStore.objects.filter(key__in=keys).values_list(
+                    'key', flat=True
+                )
+            )
+            unused = [name for key, name in keys.items() if key not in known]
+            self.report('файлов миниатюр', storage, unused)
+            if not self.dry_run:
+                for name in unused:
+                    storage.delete(name)
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        self.totals = {
+            'картинок': [0, 0],
+            'вариантов': [0, 0],
+            'источников миниатюр': [0, 0],
+            'файлов миниатюр': [0, 0],
+        }
+        self.collect_originals()
+        self.collect_variants()
+        self.collect_thumbnail_sources()
+        self.collect_thumbnail_files()
+        verb = 'Будет удалено' if self.dry_run else 'Удалено'
+        for label, (count, size) in self.totals.items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{verb} {label}: {count}'
+                + (f', {filesizeformat(size)}' if size else '')
+            ))
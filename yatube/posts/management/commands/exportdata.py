@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает посты, комментарии или подписки в NDJSON или CSV '
+        'пачками по pk, не держа всю таблицу в памяти'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('data', choices=export.SOURCES)
+        parser.add_argument(
+            '--format',
+            choices=export.FORMATS,
+            default='ndjson',
+            help='Формат выгрузки',
+        )
+        parser.add_argument(
+            '--user',
+            help='Выгрузить только данные этого пользователя',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=export.BATCH_SIZE,
+            help='Сколько строк выбирать одним запросом',
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Файл для выгрузки, по умолчанию стандартный вывод',
+        )
+
+    def handle(self, *args, **options):
+        model = export.SOURCES[options['data']]
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(
+                    f'Пользователь {options["user"]} не найден'
+                )
+            queryset = export.owned_by(model, user)
+        else:
+            queryset = model._default_manager.all()
+        chunks = export.stream(
+            queryset, options['format'], options['batch_size']
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            output.writelines(chunks)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгрузка записана в {options["output"]}'
+        ))
@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import caching, images
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+
+def prepare(name):
+    try:
+        return images.variants_for(name)
+    except Exception:
+        logger.exception('Не удалось создать варианты картинки %s', name)
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт варианты картинок постов (WebP и JPEG разных ширин) '
+        'в нескольких процессах'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Число процессов (по умолчанию — число ядер)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько имён файлов читать из базы за раз',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать варианты и для постов, у которых они уже есть',
+        )
+
+    def batches(self, batch_size, everything):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        if not everything:
+            posts = posts.filter(image_variants='')
+        posts = posts.order_by('pk').values_list('pk', 'image')
+        last_pk = 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1][0]
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        done = failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=get_context('fork'),
+        ) as executor:
+            for batch in self.batches(options['batch_size'], options['all']):
+                # Процессы пула создаются при первой отправке задач и не
+                # должны унаследовать открытое соединение с базой.
+                connections.close_all()
+                results = executor.map(
+                    prepare, [name for _, name in batch], chunksize=16
+                )
+                for (pk, name), variants in zip(batch, results):
+                    if variants is None:
+                        failed += 1
+                        continue
+                    images.store(
+                        pk, name, image_variants=json.dumps(variants)
+                    )
+                    done += 1
+        caching.bump_feed_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done}, с ошибками: {failed} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,263 @@
+import json
+import os
+import re
+import tempfile
+import time
+
+from django.apps import apps
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+
+CHUNK_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'\s*')
+# Разделители массива: (состояние, символ) -> следующее состояние.
+TRANSITIONS = {
+    ('start', '['): 'first',
+    ('first', ']'): 'end',
+    ('next', ']'): 'end',
+    ('next', ','): 'value',
+}
+
+
+def iter_array(stream, chunk_size=CHUNK_SIZE):
+    """Элементы JSON-массива из `stream` по одному.
+
+    Файл читается кусками по `chunk_size` символов, в памяти держится
+    только недоразобранный остаток, поэтому размер файла не важен.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    state = 'start'
+    exhausted = False
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if state in ('first', 'value') and char != ']':
+                try:
+                    value, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Элемент дочитан не до конца, нужен следующий кусок.
+                    if exhausted:
+                        raise
+                else:
+                    yield value
+                    state = 'next'
+                    continue
+            else:
+                position += 1
+                if (state, char) not in TRANSITIONS:
+                    raise ValueError(f'неожиданный символ {char!r}')
+                state = TRANSITIONS[state, char]
+                continue
+        elif exhausted:
+            if state == 'end':
+                return
+            raise ValueError('файл оборвался посреди массива')
+        chunk = stream.read(chunk_size)
+        buffer, position = buffer[position:] + chunk, 0
+        exhausted = not chunk
+
+
+def dependency_order(models):
+    """Модели в таком порядке, чтобы связанные шли раньше ссылающихся."""
+    ordered = []
+    visiting = set()
+
+    def visit(model):
+        if model in ordered or model in visiting:
+            return
+        visiting.add(model)
+        for field in model._meta.get_fields():
+            forward = field.concrete or (
+                field.many_to_many and not field.auto_created
+            )
+            related = field.related_model
+            if forward and related in models and related is not model:
+                visit(related)
+        visiting.discard(model)
+        ordered.append(model)
+
+    for model in sorted(models, key=lambda model: model._meta.label):
+        visit(model)
+    return ordered
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает большой JSON-дамп (формат dumpdata) потоково: '
+        'пакетами bulk_create в порядке зависимостей моделей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixture', help='Путь к JSON-файлу дампа')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк вставлять одним запросом',
+        )
+        parser.add_argument(
+            '-e', '--exclude',
+            action='append',
+            default=[],
+            help='Пропустить приложение или модель (app_label[.Model])',
+        )
+
+    def excluded(self, label):
+        app_label = label.split('.')[0]
+        return label in self.exclude or app_label in self.exclude
+
+    def spool(self, path, directory):
+        """Разложить строки дампа по файлам моделей, вернуть их счётчики.
+
+        Порядок строк в дампе произвольный, а вставлять их нужно в
+        порядке зависимостей, поэтому сначала строки каждой модели
+        копятся в своём файле на диске.
+        """
+        files = {}
+        counts = {}
+        try:
+            with open(path, encoding='utf-8') as stream:
+                for row in iter_array(stream):
+                    label = row['model'].lower()
+                    if self.excluded(label):
+                        continue
+                    if label not in files:
+                        try:
+                            apps.get_model(label)
+                        except LookupError:
+                            raise CommandError(
+                                f'Неизвестная модель в дампе: {label}'
+                            )
+                        files[label] = open(
+                            os.path.join(directory, f'{label}.jsonl'),
+                            'w', encoding='utf-8',
+                        )
+                        counts[label] = 0
+                    files[label].write(json.dumps(row) + '\n')
+                    counts[label] += 1
+        except (ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось разобрать {path}: {error}')
+        finally:
+            for spooled in files.values():
+                spooled.close()
+        return counts
+
+    def secondary_indexes(self, models):
+        """Неуникальные индексы таблиц `models` (только SQLite)."""
+        if connection.vendor != 'sqlite':
+            return []
+        tables = {model._meta.db_table for model in models}
+        for model in models:
+            for field in model._meta.local_many_to_many:
+                tables.add(field.remote_field.through._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+                "AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%%' "
+                f"AND tbl_name IN ({', '.join(['%s'] * len(tables))})",
+                list(tables),
+            )
+            return cursor.fetchall()
+
+    def insert(self, model, rows):
+        objects = list(serializers.deserialize(
+            'python', rows, ignorenonexistent=True
+        ))
+        model._base_manager.bulk_create(
+            [deserialized.object for deserialized in objects],
+            ignore_conflicts=True,
+        )
+        for field in model._meta.local_many_to_many:
+            through = field.remote_field.through
+            if not through._meta.auto_created:
+                continue
+            source = f'{field.m2m_field_name()}_id'
+            target = f'{field.m2m_reverse_field_name()}_id'
+            through._base_manager.bulk_create(
+                [
+                    through(**{source: deserialized.object.pk, target: pk})
+                    for deserialized in objects
+                    for pk in deserialized.m2m_data.get(field.name, ())
+                ],
+                ignore_conflicts=True,
+            )
+
+    def load(self, model, path):
+        batch = []
+        with open(path, encoding='utf-8') as rows:
+            for line in rows:
+                batch.append(json.loads(line))
+                if len(batch) == self.batch_size:
+                    self.insert(model, batch)
+                    batch = []
+        if batch:
+            self.insert(model, batch)
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.exclude = {label.lower() for label in options['exclude']}
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory() as directory:
+            counts = self.spool(options['fixture'], directory)
+            models = dependency_order(
+                {apps.get_model(label) for label in counts}
+            )
+            loading = time.monotonic()
+            try:
+                with transaction.atomic():
+                    indexes = self.secondary_indexes(models)
+                    with connection.cursor() as cursor:
+                        for name, sql in indexes:
+                            cursor.execute(f'DROP INDEX "{name}"')
+                    inserted = 0
+                    for model in models:
+                        label = model._meta.label_lower
+                        model_started = time.monotonic()
+                        # ignore_conflicts молча пропускает строки,
+                        # которые уже есть в базе, поэтому вставленные
+                        # считаются по приросту таблицы.
+                        before = model._base_manager.count()
+                        self.load(model, os.path.join(
+                            directory, f'{label}.jsonl'
+                        ))
+                        added = model._base_manager.count() - before
+                        inserted += added
+                        line = (
+                            f'  {label}: {added} строк за '
+                            f'{time.monotonic() - model_started:.1f} с'
+                        )
+                        if counts[label] > added:
+                            line += f', пропущено: {counts[label] - added}'
+                        self.stdout.write(line)
+                    with connection.cursor() as cursor:
+                        for name, sql in indexes:
+                            cursor.execute(sql)
+                        for sql in connection.ops.sequence_reset_sql(
+                            no_style(), models
+                        ):
+                            cursor.execute(sql)
+            except DatabaseError as error:
+                raise CommandError(f'Дамп не загружен: {error}')
+        skipped = sum(counts.values()) - inserted
+        elapsed = time.monotonic() - loading
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено строк: {inserted} за {elapsed:.1f} с '
+            f'({inserted / max(elapsed, 1e-6):.0f} строк/с), '
+            f'всего {time.monotonic() - started:.1f} с'
+        ))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено строк, уже бывших в базе: {skipped}'
+            ))
+        # bulk_create не шлёт сигналов: пересчитываем то, что
+        # поддерживают обработчики post_save, включая ссылки
+        # StoredFile на картинки постов.
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_timelines', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
@@ -0,0 +1,64 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import caching
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в раскладку по хешу содержимого; '
+        'прерванный перенос можно запустить снова'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Сколько постов переносить за одну транзакцию',
+        )
+
+    def move(self, storage, pk, name):
+        with storage.open(name) as content:
+            new_name = storage.save(name, content)
+        updated = Post.objects.filter(pk=pk, image=name).update(
+            image=new_name
+        )
+        if not updated:
+            storage.delete(new_name)
+        elif not Post.objects.filter(image=name).exists():
+            storage.delete(name)
+        return updated
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        posts = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).order_by('pk').values_list('pk', 'image')
+        moved = failed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_pk)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                for pk, name in batch:
+                    if storage.is_hashed(name):
+                        continue
+                    try:
+                        moved += self.move(storage, pk, name)
+                    except OSError:
+                        logger.exception('Не удалось перенести %s', name)
+                        failed += 1
+            last_pk = batch[-1][0]
+        caching.bump_feed_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено картинок: {moved}, с ошибками: {failed}'
+        ))
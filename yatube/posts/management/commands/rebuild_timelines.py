@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import feed
+from posts.models import Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок из таблицы Follow'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Пересобрать ленту только этого пользователя (username)',
+        )
+
+    def handle(self, *args, **options):
+        follows = Follow.objects.order_by('pk')
+        entries = TimelineEntry.objects.all()
+        if options['user']:
+            follows = follows.filter(user__username=options['user'])
+            entries = entries.filter(user__username=options['user'])
+        with transaction.atomic():
+            entries.delete()
+            rebuilt = 0
+            for user_id, author_id in follows.values_list(
+                'user_id', 'author_id'
+            ).iterator():
+                feed.backfill(user_id, author_id)
+                rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано подписок: {rebuilt}'
+        ))
@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import caching, counters
+from posts.models import Group, Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сохранённые счётчики с данными и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк сверять за одну транзакцию',
+        )
+
+    def reconcile(self, queryset, reconcile, batch_size):
+        fixed = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return fixed
+            with transaction.atomic():
+                fixed += reconcile(ids)
+            last_pk = ids[-1]
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for label, queryset, reconcile in (
+            ('пользователей', User.objects, counters.reconcile_users),
+            ('групп', Group.objects, counters.reconcile_groups),
+            ('постов', Post.objects, counters.reconcile_posts),
+            ('ссылок на картинки', Post.objects, counters.reconcile_images),
+        ):
+            fixed = self.reconcile(queryset, reconcile, batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                f'Исправлено счётчиков {label}: {fixed}'
+            ))
+        caching.bump_feed_version()
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+def fill_index(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    rows = (
+        (
+            post.pk,
+            post.text,
+            post.group.title if post.group_id else '',
+            f'{post.author.first_name} {post.author.last_name} '
+            f'{post.author.username}',
+        )
+        for post in Post.objects.select_related(
+            'author', 'group'
+        ).order_by('pk').iterator()
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO posts_postsearch '
+            '(rowid, text, group_title, author_name) '
+            'VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE VIRTUAL TABLE posts_postsearch USING fts5("
+            "text, group_title, author_name, "
+            "tokenize='unicode61 remove_diacritics 2')",
+            'DROP TABLE posts_postsearch',
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
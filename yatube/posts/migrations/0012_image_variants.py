@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_postsearch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.TextField(blank=True, editable=False, help_text='Адреса уменьшенных копий картинки в формате JSON', verbose_name='Варианты картинки'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def forget_variants(apps, schema_editor):
+    # Варианты раньше назывались по основе имени без расширения и
+    # могли принадлежать другой картинке. Их пересоздаст
+    # generate_thumbnails, а старые файлы уберёт collect_media_garbage.
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.exclude(image_variants='').update(image_variants='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(forget_variants, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,6 @@
+import json
+
+from core.storage import ContentAddressedStorage
 from django.contrib.auth import get_user_model
 from django.db import models
 
@@ -22,6 +25,12 @@ class Group(models.Model):
         help_text='Описание группы',
         max_length=255
     )
+    posts_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число постов',
+        help_text='Счётчик постов группы',
+    )
 
     def __str__(self):
         return self.title
@@ -40,6 +49,7 @@ class Post(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='posts',
         verbose_name='Автор',
         help_text='Автор поста',
@@ -49,6 +59,7 @@ class Post(models.Model):
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
+        db_index=False,
         related_name='posts',
         verbose_name='Группа',
         help_text='Группа, к которой будет относится пост'
@@ -56,23 +67,76 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True
     )
+    comments_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число комментариев',
+        help_text='Счётчик комментариев к посту',
+    )
+    image_variants = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Варианты картинки',
+        help_text='Адреса уменьшенных копий картинки в формате JSON',
+    )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Ширина картинки',
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Высота картинки',
+    )
+    image_size = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Размер картинки',
+        help_text='Размер файла картинки в байтах',
+    )
+    image_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        verbose_name='Хеш картинки',
+        help_text='SHA-256 содержимого файла картинки',
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Превью картинки',
+        help_text='Размытое превью картинки в виде data URI',
+    )
 
     class Meta:
         ordering = ('-pk', )
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = (
+            models.Index(fields=('group', '-id'), name='post_group_feed'),
+            models.Index(fields=('author', '-id'), name='post_author_feed'),
+        )
 
     def __str__(self):
         return f"«{self.text[0:15]}...»"
 
+    @property
+    def variants(self):
+        if self.image_variants:
+            return json.loads(self.image_variants)
+        return None
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='comments',
         verbose_name='Пост',
         help_text='Комментируемый пост'
@@ -94,6 +158,11 @@ class Comment(models.Model):
         help_text='Время и дата, когда коммент был написан'
     )
 
+    class Meta:
+        indexes = (
+            models.Index(fields=('post', 'created'), name='comment_thread'),
+        )
+
     def __str__(self):
         return f"«{self.text[0:15]}...»"
 
@@ -102,6 +171,7 @@ class Follow(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='follower',
         verbose_name='Подписчик',
         help_text='Подписанный пользователь'
@@ -109,6 +179,7 @@ class Follow(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='following',
         verbose_name='Автор',
         help_text='Автор, на которого можно подписаться'
@@ -121,6 +192,69 @@ class Follow(models.Model):
                 name='user_is_author',
             ),
         )
+        indexes = (
+            models.Index(fields=('author', 'user'), name='follow_followers'),
+        )
 
     def __str__(self):
         return f'{self.user.username} подписан на {self.author.username}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        help_text='Пользователь, в ленту которого попал пост'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+        help_text='Пост автора, на которого подписан пользователь'
+    )
+
+    class Meta:
+        ordering = ('-post_id', )
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='unique_timeline_entry',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.post} в ленте {self.user.username}'
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.IntegerField(
+        default=0,
+        verbose_name='Число постов',
+    )
+    followers_count = models.IntegerField(
+        default=0,
+        verbose_name='Число подписчиков',
+    )
+    following_count = models.IntegerField(
+        default=0,
+        verbose_name='Число подписок',
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return f'Счётчики {self.user.username}'
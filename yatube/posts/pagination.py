@@ -0,0 +1,114 @@
+from django.core.paginator import Page, Paginator
+
+# Ключи хранятся в INTEGER SQLite: знаковое 64-битное целое.
+MAX_CURSOR = 2 ** 63 - 1
+
+
+class CursorPaginator(Paginator):
+    """Постраничный вывод по ключу `pk` без COUNT и OFFSET.
+
+    Лента упорядочена по `-pk`, поэтому следующая страница — это
+    записи с `pk` меньше последнего на текущей (`?before=<id>`),
+    а предыдущая — записи с `pk` больше первого (`?after=<id>`).
+    Вместо `pk` можно указать другое возрастающее поле (`key`),
+    а `transform` превращает строку выборки в объект страницы.
+    Общее число записей не считается: `num_pages` знает только,
+    есть ли страницы до и после текущей.
+    """
+
+    def __init__(self, object_list, per_page, key='pk', transform=None):
+        if key is not None:
+            object_list = object_list.order_by(f'-{key}')
+        super().__init__(object_list, per_page)
+        self.key = key
+        self.transform = transform
+        self._number = 1
+        self._has_next = False
+
+    @property
+    def num_pages(self):
+        return self._number + int(self._has_next)
+
+    @property
+    def count(self):
+        return None
+
+    @staticmethod
+    def _cursor(value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None
+        if not -MAX_CURSOR - 1 <= value <= MAX_CURSOR:
+            return None
+        return value
+
+    def validate_number(self, number):
+        return number
+
+    def fetch(self, before, after, limit):
+        """Вернуть до `limit` пар (курсор, объект) в порядке обхода.
+
+        При `after` записи идут по возрастанию ключа (ближайшие
+        к курсору первыми), иначе — по убыванию.
+        """
+        if after is not None:
+            queryset = self.object_list.filter(
+                **{f'{self.key}__gt': after}
+            ).order_by(self.key)
+        elif before is not None:
+            queryset = self.object_list.filter(**{f'{self.key}__lt': before})
+        else:
+            queryset = self.object_list
+        return [
+            (
+                getattr(row, self.key),
+                self.transform(row) if self.transform else row,
+            )
+            for row in queryset[:limit]
+        ]
+
+    def get_page(self, before=None, after=None):
+        before = self._cursor(before)
+        after = self._cursor(after)
+        rows = self.fetch(before, after, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if after is not None:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, before is not None
+        has_next = has_next and bool(rows)
+        has_previous = has_previous and bool(rows)
+        self._number = 2 if has_previous else 1
+        self._has_next = has_next
+        page = Page([item for _, item in rows], self._number, self)
+        page.next_cursor = rows[-1][0] if has_next else None
+        page.previous_cursor = rows[0][0] if has_previous else None
+        return page
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """Сливает несколько курсорных источников в одну ленту.
+
+    Все источники должны использовать общее пространство ключей
+    (например, `pk` поста). Каждый источник отдаёт не больше
+    `limit` записей, поэтому страница стоит столько же запросов,
+    сколько источников, на любой глубине. Повторы по ключу
+    схлопываются.
+    """
+
+    def __init__(self, sources, per_page):
+        super().__init__([], per_page, key=None)
+        self.sources = sources
+
+    def fetch(self, before, after, limit):
+        merged = {}
+        for source in self.sources:
+            merged.update(source.fetch(before, after, limit))
+        return sorted(
+            merged.items(),
+            key=lambda pair: pair[0],
+            reverse=after is None,
+        )[:limit]
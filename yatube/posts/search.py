@@ -0,0 +1,159 @@
+import math
+import re
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from posts.models import Post
+from posts.pagination import MAX_CURSOR
+
+TABLE = 'posts_postsearch'
+BATCH_SIZE = 1000
+SNIPPET_TOKENS = 16
+MARK_START = '\x02'
+MARK_END = '\x03'
+WORD = re.compile(r'\w+')
+
+
+def _row(post):
+    return (
+        post.pk,
+        post.text,
+        post.group.title if post.group_id else '',
+        f'{post.author.get_full_name()} {post.author.username}',
+    )
+
+
+def index_posts(posts):
+    rows = [_row(post) for post in posts]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {TABLE} WHERE rowid = %s',
+            [(row[0],) for row in rows],
+        )
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, text, group_title, author_name) '
+            f'VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+
+def unindex_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+
+
+def index_queryset(posts, batch_size=BATCH_SIZE):
+    """Проиндексировать посты пачками по `pk`, вернуть их число.
+
+    Каждая пачка пишется своей транзакцией, чтобы долгая
+    переиндексация не держала блокировку записи SQLite целиком.
+    """
+    posts = posts.select_related('author', 'group').order_by('pk')
+    indexed = 0
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return indexed
+        with transaction.atomic():
+            index_posts(batch)
+        indexed += len(batch)
+        last_pk = batch[-1].pk
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Переиндексировать все посты и убрать строки удалённых.
+
+    Индекс не очищается заранее, поэтому поиск работает и во время
+    перестройки.
+    """
+    indexed = index_queryset(Post.objects.all(), batch_size)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE rowid NOT IN '
+            f'(SELECT id FROM {Post._meta.db_table})'
+        )
+    return indexed
+
+
+def reindex_group(group_id):
+    """Задача очереди: переиндексировать посты группы после правки."""
+    return index_queryset(Post.objects.filter(group_id=group_id))
+
+
+def match_expression(query):
+    """Превратить ввод пользователя в безопасное выражение FTS5.
+
+    Каждое слово берётся в кавычки как отдельная фраза, последнее —
+    с поиском по префиксу, так что операторы FTS5 во вводе не
+    работают и не ломают запрос.
+    """
+    words = WORD.findall(query)
+    if not words:
+        return None
+    phrases = [f'"{word}"' for word in words]
+    phrases[-1] += '*'
+    return ' '.join(phrases)
+
+
+def _parse_cursor(cursor):
+    try:
+        rank, post_id = cursor.split(':')
+        rank, post_id = float(rank), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+    if not math.isfinite(rank) or not 0 < post_id <= MAX_CURSOR:
+        return None
+    return rank, post_id
+
+
+def _highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+def search(query, cursor=None, limit=10):
+    """Найти посты по BM25; вернуть (посты, курсор следующей страницы).
+
+    Страницы листаются по ключу (rank, rowid), поэтому глубина
+    страницы не влияет на её стоимость. У каждого поста есть
+    атрибут `snippet` с подсвеченным фрагментом текста.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return [], None
+    sql = (
+        f'SELECT rowid, rank, snippet({TABLE}, 0, %s, %s, %s, %s) '
+        f'FROM {TABLE} WHERE {TABLE} MATCH %s'
+    )
+    params = [MARK_START, MARK_END, '…', SNIPPET_TOKENS, expression]
+    position = _parse_cursor(cursor)
+    if position is not None:
+        sql += ' AND (rank > %s OR (rank = %s AND rowid < %s))'
+        params += [position[0], position[0], position[1]]
+    sql += ' ORDER BY rank, rowid DESC LIMIT %s'
+    params.append(limit + 1)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f'{rows[-1][1]!r}:{rows[-1][0]}'
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [row[0] for row in rows]
+    )
+    found = []
+    for post_id, _, snippet in rows:
+        post = posts.get(post_id)
+        if post is not None:
+            post.snippet = _highlight(snippet)
+            found.append(post)
+    return found, next_cursor
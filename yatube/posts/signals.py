@@ -0,0 +1,180 @@
+from core import jobs
+from core.replica import replica_synced
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from posts import caching, counters, feed, images, search
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous(sender, instance, raw=False, **kwargs):
+    # Несохранённый файл будет записан в хранилище при этом save()
+    # и получит новую ссылку, даже если содержимое то же.
+    instance._image_uploaded = bool(
+        instance.image and not instance.image._committed
+    )
+    if instance.pk and not raw:
+        instance._previous_group_id, instance._previous_image = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image'
+            ).first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.add_to_user(instance.author_id, posts_count=1)
+        counters.add_to_group(instance.group_id, 1)
+        return
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        counters.add_to_group(previous_group_id, -1)
+        counters.add_to_group(instance.group_id, 1)
+    instance._previous_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.add_to_user(instance.author_id, posts_count=-1)
+    counters.add_to_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.add_to_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.add_to_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.add_to_user(instance.author_id, followers_count=1)
+        counters.add_to_user(instance.user_id, following_count=1)
+        feed.followers_changed(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.add_to_user(instance.author_id, followers_count=-1)
+    counters.add_to_user(instance.user_id, following_count=-1)
+    feed.followers_changed(instance.author_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feed.push_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feed.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    feed.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_feeds(sender, **kwargs):
+    # Только после фиксации: иначе другой запрос прочитает новую
+    # версию, отрисует старый снимок базы и закеширует его под ней.
+    transaction.on_commit(caching.bump_feed_version)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author_pages(sender, update_fields=None, **kwargs):
+    # Имена авторов есть во всех лентах, а профиль нового
+    # пользователя перестаёт быть 404. Вход меняет только last_login.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(caching.bump_feed_version)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follower_pages(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: caching.bump_user_version(instance.user_id)
+    )
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_posts([instance])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def reindex_group_posts(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    jobs.enqueue(search.reindex_group, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def process_image(sender, instance, created, raw=False, **kwargs):
+    name = instance.image.name if instance.image else None
+    previous = getattr(instance, '_previous_image', None)
+    if raw:
+        return
+    if name == previous:
+        if previous and getattr(instance, '_image_uploaded', False):
+            # Загружено то же содержимое: хранилище добавило ссылку,
+            # лишнюю снимаем, а варианты картинки остаются прежними.
+            images.release(previous)
+        return
+    instance._previous_image = name
+    if not created:
+        for field, value in images.EMPTY_FIELDS.items():
+            setattr(instance, field, value)
+        Post.objects.filter(pk=instance.pk).update(**images.EMPTY_FIELDS)
+    if previous:
+        images.release(previous)
+    if name:
+        jobs.enqueue(images.build, instance.pk, name)
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    if instance.image:
+        images.release(instance.image.name)
+
+
+@receiver(replica_synced)
+def show_replicated_posts(sender, **kwargs):
+    # Фрагменты, собранные из отставшей реплики, не должны
+    # пережить синхронизацию.
+    caching.bump_feed_version()
@@ -1,11 +1,22 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.client import encode_multipart
 from django.urls import reverse
+from core.uploads import RejectedUpload
+from PIL import Image
 from posts.models import Group, Post, Comment
 
 User = get_user_model()
 
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
 
 class PostCreateFormTests(TestCase):
     @classmethod
@@ -121,3 +132,70 @@ class CommentsCreateTest(TestCase):
                 post=CommentsCreateTest.post
             ).exists()
         )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageIngestTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='authh')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(ImageIngestTest.user)
+
+    def upload(self, name, content):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Пост с картинкой',
+                'image': SimpleUploadedFile(name, content),
+            },
+        )
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=1000)
+    def test_oversized_upload_rejected(self):
+        content = BytesIO()
+        Image.frombytes('L', (100, 100), os.urandom(10000)).save(
+            content, 'PNG'
+        )
+        response = self.upload('noise.png', content.getvalue())
+        self.assertFalse(Post.objects.exists())
+        self.assertTrue(response.context['form'].has_error(
+            'image', code='file_too_large'
+        ))
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=1000)
+    def test_oversized_upload_stops_reading_body(self):
+        body = encode_multipart('BoUnDaRy', {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile('big.png', os.urandom(200000)),
+        })
+        stream = BytesIO(body)
+        request = RequestFactory().generic(
+            'POST', '/', body,
+            content_type='multipart/form-data; boundary=BoUnDaRy',
+            **{'wsgi.input': stream},
+        )
+        self.assertIsInstance(request.FILES['image'], RejectedUpload)
+        self.assertEqual(request.POST['text'], 'Пост с картинкой')
+        self.assertLess(stream.tell(), len(body) // 2)
+
+    @override_settings(POST_IMAGE_MAX_DIMENSION=40)
+    def test_large_upload_normalized(self):
+        content = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (200, 100), 'red').save(content, 'JPEG', exif=exif)
+        self.upload('photo.jpeg', content.getvalue())
+        post = Post.objects.get()
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (20, 40))
+            self.assertNotIn(0x0112, image.getexif())
@@ -1,6 +1,9 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
-from posts.models import Group, Post, Comment, Follow
+from posts.models import Group, Post, Comment, Follow, UserStats
 
 User = get_user_model()
 
@@ -194,3 +197,98 @@ class CommentModelTest(TestCase):
             with self.subTest(field=field):
                 verbose = comment._meta.get_field(field).help_text
                 self.assertEqual(verbose, help_text)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='group',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-group',
+            description='Тестовое описание',
+        )
+
+    def refresh(self, *objects):
+        for obj in objects:
+            obj.refresh_from_db()
+
+    def test_post_counters(self):
+        post = Post.objects.create(
+            text='Тестовый пост',
+            author=CountersTest.user,
+            group=CountersTest.group,
+        )
+        stats = CountersTest.user.stats
+        self.refresh(stats, CountersTest.group)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(CountersTest.group.posts_count, 1)
+        post.group = CountersTest.other_group
+        post.save()
+        self.refresh(CountersTest.group, CountersTest.other_group)
+        self.assertEqual(CountersTest.group.posts_count, 0)
+        self.assertEqual(CountersTest.other_group.posts_count, 1)
+        post.delete()
+        self.refresh(stats, CountersTest.other_group)
+        self.assertEqual(stats.posts_count, 0)
+        self.assertEqual(CountersTest.other_group.posts_count, 0)
+
+    def test_comment_counter(self):
+        post = Post.objects.create(
+            text='Тестовый пост',
+            author=CountersTest.user,
+        )
+        comment = Comment.objects.create(
+            post=post,
+            author=CountersTest.reader,
+            text='Комментарий',
+        )
+        self.refresh(post)
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        self.refresh(post)
+        self.assertEqual(post.comments_count, 0)
+
+    def test_follow_counters(self):
+        follow = Follow.objects.create(
+            user=CountersTest.reader,
+            author=CountersTest.user,
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=CountersTest.user).followers_count, 1
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=CountersTest.reader).following_count, 1
+        )
+        follow.delete()
+        self.assertEqual(
+            UserStats.objects.get(user=CountersTest.user).followers_count, 0
+        )
+
+    def test_reconcile_counters_command(self):
+        Post.objects.create(
+            text='Тестовый пост',
+            author=CountersTest.user,
+            group=CountersTest.group,
+        )
+        UserStats.objects.filter(user=CountersTest.user).update(
+            posts_count=42
+        )
+        UserStats.objects.filter(user=CountersTest.reader).delete()
+        Group.objects.filter(pk=CountersTest.group.pk).update(posts_count=0)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=CountersTest.user).posts_count, 1
+        )
+        self.assertTrue(
+            UserStats.objects.filter(user=CountersTest.reader).exists()
+        )
+        self.refresh(CountersTest.group)
+        self.assertEqual(CountersTest.group.posts_count, 1)
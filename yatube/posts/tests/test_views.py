@@ -1,17 +1,59 @@
+import csv
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import mock
 from operator import attrgetter
 
 from django import forms
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from core import jobs
+from core.models import Job, StoredFile
+from django.conf import settings
 from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from posts.models import Follow, Group, Post
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+from posts import caching, export, images, search
+from posts.management.commands.importdata import iter_array
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          UserStats)
 from yatube.settings import NUM_POSTS_PER_PAGE
 
 User = get_user_model()
 
 
+def make_legacy_thumbnail(name):
+    """Миниатюра sorl, какие лента создавала до вариантов картинок."""
+    get_thumbnail(name, '960x339', crop='center', upscale=True)
+
+
+@contextmanager
+def committed():
+    """Выполнить колбэки on_commit, отложенные внутри блока.
+
+    TestCase не фиксирует транзакцию, поэтому сами они не сработают.
+    """
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for _, callback in callbacks:
+        callback()
+
+
 class PostPagesTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -174,8 +216,37 @@ class PaginatorViewsTest(TestCase):
                     response.context.get('page_obj').object_list[0:10],
                     obj_list_1st_page
                 )
-                response = self.client.get(page + '?page=2')
+                next_cursor = response.context['page_obj'].next_cursor
+                response = self.client.get(page + f'?before={next_cursor}')
                 self.assertEqual(len(response.context['page_obj']), posts_rest)
+                self.assertFalse(response.context['page_obj'].has_next())
+                previous_cursor = response.context['page_obj'].previous_cursor
+                response = self.client.get(page + f'?after={previous_cursor}')
+                self.assertEqual(
+                    response.context.get('page_obj').object_list,
+                    obj_list_1st_page
+                )
+                self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_oversized_cursor_shows_first_page(self):
+        client = Client()
+        client.force_login(PaginatorViewsTest.user)
+        pages = [
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'authh'}),
+            reverse('posts:follow_index'),
+        ]
+        for page in pages:
+            for param in ('before', 'after'):
+                with self.subTest(page=page, param=param):
+                    response = client.get(
+                        page, {param: '99999999999999999999999'}
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertFalse(
+                        response.context['page_obj'].has_previous()
+                    )
 
 
 class PostPagesTest(TestCase):
@@ -239,13 +310,41 @@ class PostPagesTest(TestCase):
             group=PostPagesTest.group,
         )
         cache_content = self.get_content()
-        self.test_post.delete()
+        Post.objects.filter(pk=self.test_post.pk).update(text='Тихая правка')
         new_content = self.get_content()
         self.assertEqual(cache_content, new_content)
         cache.clear()
         new_new_content = self.get_content()
         self.assertNotEqual(cache_content, new_new_content)
 
+    def test_cache_invalidated_on_post_changes(self):
+        cache_content = self.get_content()
+        with committed():
+            test_post = Post.objects.create(
+                text='Новый пост',
+                author=PostPagesTest.user,
+            )
+        created_content = self.get_content()
+        self.assertNotEqual(cache_content, created_content)
+        self.assertIn('Новый пост', created_content.decode())
+        with committed():
+            test_post.delete()
+        self.assertNotIn('Новый пост', self.get_content().decode())
+
+    def test_feed_version_bumped_after_commit(self):
+        version = caching.feed_version()
+        with committed():
+            Post.objects.create(text='Новый пост', author=PostPagesTest.user)
+            self.assertEqual(caching.feed_version(), version)
+        self.assertNotEqual(caching.feed_version(), version)
+
+    def test_cache_varies_by_cursor(self):
+        first_page = self.get_content()
+        response = self.guest_client.get(
+            reverse('posts:index') + f'?before={PostPagesTest.post.pk}'
+        )
+        self.assertNotEqual(first_page, response.content)
+
 
 class FollowTest(TestCase):
     @classmethod
@@ -334,3 +433,1121 @@ class FollowTest(TestCase):
             post_2,
             response_2.context.get('page_obj').object_list
         )
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.follower = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='auth')
+        cls.old_post = Post.objects.create(
+            text='Старый пост',
+            author=cls.author,
+        )
+
+    def setUp(self):
+        self.authorized_follower = Client()
+        self.authorized_follower.force_login(TimelineTest.follower)
+        self.authorized_author = Client()
+        self.authorized_author.force_login(TimelineTest.author)
+
+    def timeline_posts(self):
+        return list(
+            TimelineEntry.objects.filter(
+                user=TimelineTest.follower
+            ).values_list('post_id', flat=True)
+        )
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        self.authorized_follower.get(
+            reverse('posts:profile_follow', kwargs={'username': 'auth'})
+        )
+        self.assertEqual(self.timeline_posts(), [TimelineTest.old_post.pk])
+        self.authorized_follower.get(
+            reverse('posts:profile_unfollow', kwargs={'username': 'auth'})
+        )
+        self.assertEqual(self.timeline_posts(), [])
+
+    def test_post_create_fans_out_to_followers(self):
+        Follow.objects.create(
+            user=TimelineTest.follower,
+            author=TimelineTest.author
+        )
+        self.authorized_author.post(
+            reverse('posts:post_create'),
+            data={'text': 'Новый пост'},
+        )
+        new_post = Post.objects.get(text='Новый пост')
+        self.assertEqual(
+            self.timeline_posts(),
+            [new_post.pk, TimelineTest.old_post.pk]
+        )
+        response = self.authorized_follower.get(
+            reverse('posts:follow_index')
+        )
+        self.assertEqual(
+            response.context['page_obj'].object_list,
+            [new_post, TimelineTest.old_post]
+        )
+
+    def test_rebuild_timelines_command(self):
+        Follow.objects.create(
+            user=TimelineTest.follower,
+            author=TimelineTest.author
+        )
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(self.timeline_posts(), [TimelineTest.old_post.pk])
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_celebrity_posts_are_pulled_on_read(self):
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=TimelineTest.author)
+        Follow.objects.create(
+            user=TimelineTest.follower,
+            author=TimelineTest.author
+        )
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=TimelineTest.follower, author=other)
+        pushed = Post.objects.create(text='Обычный автор', author=other)
+        pulled = Post.objects.create(
+            text='Популярный автор',
+            author=TimelineTest.author
+        )
+        self.assertEqual(self.timeline_posts(), [pushed.pk])
+        response = self.authorized_follower.get(
+            reverse('posts:follow_index')
+        )
+        self.assertEqual(
+            response.context['page_obj'].object_list,
+            [pulled, pushed, TimelineTest.old_post]
+        )
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_celebrity_posts_return_to_inboxes_after_downgrade(self):
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=TimelineTest.author)
+        Follow.objects.create(
+            user=TimelineTest.follower,
+            author=TimelineTest.author
+        )
+        jobs.work(burst=True)
+        pulled = Post.objects.create(
+            text='Популярный автор',
+            author=TimelineTest.author
+        )
+        self.assertEqual(self.timeline_posts(), [])
+        Follow.objects.filter(user=fan).delete()
+        jobs.work(burst=True)
+        self.assertEqual(
+            self.timeline_posts(), [pulled.pk, TimelineTest.old_post.pk]
+        )
+        response = self.authorized_follower.get(
+            reverse('posts:follow_index')
+        )
+        self.assertEqual(
+            response.context['page_obj'].object_list,
+            [pulled, TimelineTest.old_post]
+        )
+
+
+class FeedQueryCountTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Test_group',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(NUM_POSTS_PER_PAGE):
+            author = User.objects.create_user(username=f'author{i}')
+            group = Group.objects.create(
+                title=f'Группа {i}',
+                slug=f'group-{i}',
+                description='Тестовое описание',
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+            Post.objects.create(text=f'Пост {i}', author=author, group=group)
+            Post.objects.create(
+                text=f'Пост группы {i}',
+                author=author,
+                group=cls.group
+            )
+        cls.post = Post.objects.create(
+            text='Пост с комментариями',
+            author=cls.reader,
+            group=cls.group,
+        )
+        for author in User.objects.exclude(pk=cls.reader.pk):
+            cls.post.comments.create(author=author, text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(FeedQueryCountTest.reader)
+
+    def assertQueriesWithin(self, budget, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def test_feed_pages_query_budget(self):
+        pages = {
+            reverse('posts:index'): 1,
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}): 2,
+            reverse('posts:profile', kwargs={'username': 'author0'}): 4,
+            reverse('posts:post_detail', kwargs={
+                'post_id': FeedQueryCountTest.post.pk
+            }): 3,
+        }
+        for url, budget in pages.items():
+            with self.subTest(url=url):
+                self.assertQueriesWithin(budget, self.guest_client, url)
+
+    def test_cached_fragment_skips_post_queries(self):
+        pages = (
+            (reverse('posts:index'), 0),
+            (reverse('posts:group_posts', kwargs={'slug': 'test-slug'}), 1),
+            (reverse('posts:profile', kwargs={'username': 'author0'}), 3),
+        )
+        for url, budget in pages:
+            with self.subTest(url=url):
+                first = self.guest_client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    second = self.guest_client.get(url)
+                self.assertEqual(first.content, second.content)
+                self.assertLessEqual(len(queries), budget)
+                for query in queries.captured_queries:
+                    self.assertNotIn('FROM "posts_post"', query['sql'])
+
+    def test_follow_page_query_budget(self):
+        self.assertQueriesWithin(
+            4,
+            self.authorized_client,
+            reverse('posts:follow_index')
+        )
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Test_group',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост',
+            author=cls.user,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(ConditionalGetTest.reader)
+        self.pages = [
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:post_detail', kwargs={
+                'post_id': ConditionalGetTest.post.pk
+            }),
+        ]
+
+    def revalidate(self, client, page):
+        etag = client.get(page)['ETag']
+        return client.get(page, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_unchanged_pages_answer_not_modified(self):
+        for page in self.pages:
+            with self.subTest(page=page):
+                self.assertEqual(
+                    self.revalidate(self.guest_client, page), 304
+                )
+
+    def test_pages_are_revalidated_after_changes(self):
+        for page in self.pages:
+            with self.subTest(page=page):
+                etag = self.guest_client.get(page)['ETag']
+                with committed():
+                    Comment.objects.create(
+                        post=ConditionalGetTest.post,
+                        author=ConditionalGetTest.reader,
+                        text='Комментарий',
+                    )
+                response = self.guest_client.get(
+                    page, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_follow_changes_viewer_etag(self):
+        page = reverse('posts:profile', kwargs={'username': 'auth'})
+        etag = self.authorized_client.get(page)['ETag']
+        self.assertNotEqual(etag, self.guest_client.get(page)['ETag'])
+        with committed():
+            Follow.objects.create(
+                user=ConditionalGetTest.reader,
+                author=ConditionalGetTest.user
+            )
+        response = self.authorized_client.get(page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_session_changes_etag(self):
+        page = self.pages[-1]
+        etag = self.authorized_client.get(page)['ETag']
+        self.authorized_client.logout()
+        self.authorized_client.force_login(ConditionalGetTest.reader)
+        response = self.authorized_client.get(page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.authorized_client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 64
+        response = self.authorized_client.get(
+            page, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_changes_revalidate_pages(self):
+        page = reverse('posts:profile', kwargs={'username': 'newcomer'})
+        request = RequestFactory().get(page)
+        request.user = AnonymousUser()
+        etag = f'"{caching.page_etag(request)}"'
+        self.assertEqual(
+            self.guest_client.get(page, HTTP_IF_NONE_MATCH=etag).status_code,
+            304,
+        )
+        with committed():
+            newcomer = User.objects.create_user(username='newcomer')
+        response = self.guest_client.get(page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with committed():
+            newcomer.first_name = 'Новичок'
+            newcomer.save()
+        response = self.guest_client.get(page, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новичок')
+
+    def test_login_keeps_feed_version(self):
+        version = caching.feed_version()
+        with committed():
+            Client().force_login(ConditionalGetTest.user)
+        self.assertEqual(caching.feed_version(), version)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='auth',
+            first_name='Лев',
+            last_name='Толстой',
+        )
+        cls.group = Group.objects.create(
+            title='Классика',
+            slug='classic',
+            description='Тестовое описание',
+        )
+        cls.match = Post.objects.create(
+            text='Все счастливые семьи похожи друг на друга',
+            author=cls.user,
+            group=cls.group,
+        )
+        cls.other = Post.objects.create(
+            text='Про <b>что-то</b> другое',
+            author=User.objects.create_user(username='other'),
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def find(self, query, **params):
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_search_by_text_group_and_author(self):
+        for query in ('счастливые семьи', 'классика', 'толстой', 'похо'):
+            with self.subTest(query=query):
+                response = self.find(query)
+                self.assertEqual(
+                    response.context['posts'], [SearchTest.match]
+                )
+
+    def test_search_highlights_and_escapes_snippet(self):
+        response = self.find('семьи')
+        self.assertIn('<mark>семьи</mark>', response.content.decode())
+        response = self.find('другое')
+        self.assertIn('&lt;b&gt;', response.content.decode())
+
+    def test_search_syntax_is_not_interpreted(self):
+        response = self.find('"семьи OR NEAR(')
+        self.assertEqual(response.context['posts'], [])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.create(
+            text='Уникальнослово',
+            author=SearchTest.user
+        )
+        self.assertEqual(self.find('уникальнослово').context['posts'], [post])
+        post.text = 'Заменено'
+        post.save()
+        self.assertEqual(self.find('уникальнослово').context['posts'], [])
+        post.delete()
+        self.assertEqual(self.find('заменено').context['posts'], [])
+
+    def test_search_keyset_pages(self):
+        posts = [
+            Post.objects.create(text=f'Повтор {i}', author=SearchTest.user)
+            for i in range(NUM_POSTS_PER_PAGE + 3)
+        ]
+        response = self.find('повтор')
+        first_page = response.context['posts']
+        self.assertEqual(len(first_page), NUM_POSTS_PER_PAGE)
+        response = self.find(
+            'повтор', cursor=response.context['next_cursor']
+        )
+        self.assertEqual(len(response.context['posts']), 3)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertCountEqual(
+            first_page + response.context['posts'], posts
+        )
+
+    def test_invalid_cursor_shows_first_page(self):
+        for cursor in ('1:99999999999999999999999', 'nan:1', 'inf:1',
+                       '-inf:1', '1:0'):
+            with self.subTest(cursor=cursor):
+                response = self.find('семьи', cursor=cursor)
+                self.assertEqual(
+                    response.context['posts'], [SearchTest.match]
+                )
+
+    def test_rebuild_search_index_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_postsearch')
+        self.assertEqual(self.find('семьи').context['posts'], [])
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            self.find('семьи').context['posts'], [SearchTest.match]
+        )
+
+    def test_rebuild_drops_rows_of_deleted_posts(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO posts_postsearch '
+                '(rowid, text, group_title, author_name) '
+                "VALUES (100000, 'Призрак', '', '')"
+            )
+        call_command('rebuild_search_index', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT count(*) FROM posts_postsearch WHERE rowid = 100000'
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_group_rename_reindexed_by_job(self):
+        SearchTest.group.title = 'Переименована'
+        SearchTest.group.save()
+        self.assertEqual(self.find('переименована').context['posts'], [])
+        jobs.work(burst=True)
+        self.assertEqual(
+            self.find('переименована').context['posts'], [SearchTest.match]
+        )
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class FeedThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.posts = []
+        for color in ('red', 'green', 'blue'):
+            image = BytesIO()
+            Image.new('RGB', (64, 32), color).save(image, 'PNG')
+            cls.posts.append(Post.objects.create(
+                text=f'Пост {color}',
+                author=cls.user,
+                image=SimpleUploadedFile(f'{color}.png', image.getvalue()),
+            ))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_posts_without_variants_show_placeholder(self):
+        cache.clear()
+        queued = Job.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ])
+        self.assertEqual(Job.objects.count(), queued)
+        content = response.content.decode()
+        self.assertNotIn('<img class="card-img', content)
+        self.assertEqual(content.count('aspect-ratio: 960 / 339'), 3)
+
+    def test_variants_replace_thumbnail(self):
+        post = Post.objects.get(pk=FeedThumbnailTest.posts[0].pk)
+        with override_settings(POST_IMAGE_WIDTHS=(16, 32, 128)):
+            images.build(post.pk, post.image.name)
+        post.refresh_from_db()
+        variants = post.variants
+        self.assertEqual((variants['width'], variants['height']), (32, 11))
+        self.assertEqual(variants['sources'][0]['type'], 'image/webp')
+        self.assertIn('-16w.webp 16w', variants['sources'][0]['srcset'])
+        self.assertTrue(variants['src'].endswith('-32w.jpg'))
+        self.assertEqual((post.image_width, post.image_height), (64, 32))
+        self.assertEqual(post.image_size, post.image.size)
+        self.assertEqual(len(post.image_hash), 64)
+        response = self.client.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        )
+        content = response.content.decode()
+        self.assertIn('<source type="image/webp"', content)
+        self.assertIn('width="32" height="11" loading="lazy"', content)
+
+    def test_new_image_resets_variants(self):
+        post = Post.objects.get(pk=FeedThumbnailTest.posts[1].pk)
+        Post.objects.filter(pk=post.pk).update(
+            image_variants='{}', image_width=64, image_hash='0' * 64
+        )
+        post.refresh_from_db()
+        image = BytesIO()
+        Image.new('RGB', (64, 32), 'white').save(image, 'PNG')
+        post.image = SimpleUploadedFile('white.png', image.getvalue())
+        with mock.patch('posts.images.release') as release:
+            post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, '')
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_hash, '')
+        job = Job.objects.filter(task='posts.images.build').last()
+        self.assertEqual(
+            json.loads(job.arguments), [post.pk, post.image.name]
+        )
+        release.assert_called_once_with(FeedThumbnailTest.posts[1].image.name)
+
+    def test_backfill_image_metadata(self):
+        call_command('backfill_image_metadata', stdout=StringIO())
+        for post in Post.objects.filter(
+            pk__in=[post.pk for post in FeedThumbnailTest.posts]
+        ):
+            self.assertEqual((post.image_width, post.image_height), (64, 32))
+            self.assertTrue(
+                post.image_placeholder.startswith('data:image/jpeg;base64,')
+            )
+        with mock.patch('posts.images.describe') as describe:
+            call_command('backfill_image_metadata', stdout=StringIO())
+        describe.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaLayoutTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_migrate_media_layout(self):
+        user = User.objects.create_user(username='auth')
+        legacy = default_storage.save('posts/legacy.png', ContentFile(b'x'))
+        for index in range(2):
+            Post.objects.create(text=f'Пост {index}', author=user)
+        Post.objects.update(image=legacy)
+        call_command('migrate_media_layout', batch_size=1, stdout=StringIO())
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(Post.image.field.storage.is_hashed(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+        with mock.patch.object(Post.image.field.storage, 'save') as save:
+            call_command('migrate_media_layout', stdout=StringIO())
+        save.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaGarbageTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='auth')
+
+    def create_post(self, color):
+        image = BytesIO()
+        Image.new('RGB', (64, 32), color).save(image, 'PNG')
+        post = Post.objects.create(
+            text=f'Пост {color}',
+            author=self.user,
+            image=SimpleUploadedFile(f'{color}.png', image.getvalue()),
+        )
+        make_legacy_thumbnail(post.image.name)
+        default_storage.save(
+            images.variant_name(post.image.name, 320, 'JPEG'),
+            ContentFile(b'variant'),
+        )
+        return post
+
+    def derived(self, name):
+        return (
+            default_storage.exists(images.variant_name(name, 320, 'JPEG')),
+            default.kvstore.get(ImageFile(name)) is not None,
+        )
+
+    def test_delete_releases_image_and_derived_files(self):
+        post = self.create_post('purple')
+        name = post.image.name
+        self.assertEqual(self.derived(name), (True, True))
+        with mock.patch(
+            'django.db.transaction.on_commit', lambda func: func()
+        ):
+            post.delete()
+        self.assertEqual(self.derived(name), (True, True))
+        jobs.work(burst=True)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(self.derived(name), (False, False))
+
+    def test_shared_image_kept_until_last_post_deleted(self):
+        first = self.create_post('orange')
+        second = self.create_post('orange')
+        self.assertEqual(first.image.name, second.image.name)
+        with mock.patch(
+            'django.db.transaction.on_commit', lambda func: func()
+        ):
+            first.delete()
+            jobs.work(burst=True)
+            self.assertTrue(default_storage.exists(second.image.name))
+            self.assertEqual(self.derived(second.image.name), (True, True))
+            second.delete()
+            jobs.work(burst=True)
+        self.assertFalse(default_storage.exists(second.image.name))
+        self.assertEqual(self.derived(second.image.name), (False, False))
+
+    def test_same_image_reuploaded_keeps_one_reference(self):
+        post = self.create_post('olive')
+        name = post.image.name
+        image = BytesIO()
+        Image.new('RGB', (64, 32), 'olive').save(image, 'PNG')
+        post.image = SimpleUploadedFile('again.png', image.getvalue())
+        with mock.patch(
+            'django.db.transaction.on_commit', lambda func: func()
+        ):
+            post.save()
+            self.assertEqual(post.image.name, name)
+            self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+            post.delete()
+            jobs.work(burst=True)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_referenced_file_without_post_kept(self):
+        post = self.create_post('teal')
+        name = post.image.name
+        Post.objects.filter(pk=post.pk).update(image='')
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+        self.assertFalse(Post.image.field.storage.purge(name))
+        StoredFile.objects.filter(name=name).update(references=0)
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_same_stem_images_keep_own_variants(self):
+        names = []
+        for extension in ('jpg', 'png'):
+            name = f'posts/cat.{extension}'
+            Post.objects.create(
+                text=f'Пост {extension}', author=self.user, image=name
+            )
+            default_storage.save(
+                images.variant_name(name, 320, 'JPEG'), ContentFile(b'')
+            )
+            names.append(name)
+        self.assertNotEqual(*(
+            images.variant_name(name, 320, 'JPEG') for name in names
+        ))
+        Post.objects.filter(image=names[0]).delete()
+        images.delete_derived(names[0])
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertEqual(
+            [self.derived(name)[0] for name in names], [False, True]
+        )
+
+    def test_collect_media_garbage(self):
+        kept = self.create_post('yellow')
+        orphan = self.create_post('black')
+        Post.objects.filter(pk=orphan.pk).delete()
+        stray = default_storage.save('cache/00/00/stray.jpg', ContentFile(b''))
+        output = StringIO()
+        call_command(
+            'collect_media_garbage', dry_run=True, min_age=0, stdout=output
+        )
+        self.assertIn('Будет удалено картинок: 1', output.getvalue())
+        self.assertTrue(default_storage.exists(orphan.image.name))
+        call_command('collect_media_garbage', min_age=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan.image.name))
+        self.assertEqual(self.derived(orphan.image.name), (False, False))
+        self.assertFalse(default_storage.exists(stray))
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertEqual(self.derived(kept.image.name), (True, True))
+
+
+@override_settings(FEED_CELEBRITY_THRESHOLD=100)
+class QueryPlanTest(TestCase):
+    """Запросы страниц не должны сканировать таблицы и сортировать
+    выборку во временном B-дереве на данных реального объёма.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        User.objects.bulk_create(
+            User(username=f'user{i}') for i in range(200)
+        )
+        users = list(User.objects.order_by('pk'))
+        cls.reader = users[0]
+        celebrities = users[1:3]
+        Group.objects.bulk_create(
+            Group(title=f'Группа {i}', slug=f'group-{i}', description='')
+            for i in range(20)
+        )
+        groups = list(Group.objects.all())
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=users[i % 50], group=groups[i % 20])
+            for i in range(5000)
+        )
+        Follow.objects.bulk_create(
+            [Follow(user=user, author=author)
+             for user in users
+             for author in celebrities if user != author]
+            + [Follow(user=cls.reader, author=author)
+               for author in users[:50:5] if author != cls.reader]
+        )
+        UserStats.objects.bulk_create(
+            UserStats(
+                user=user,
+                posts_count=100,
+                followers_count=199 if user in celebrities else 1,
+            )
+            for user in users
+        )
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=cls.reader, post_id=pk)
+            for pk in Post.objects.filter(
+                author__following__user=cls.reader,
+                author__stats__followers_count__lt=100,
+            ).values_list('pk', flat=True)
+        )
+        cls.post = Post.objects.order_by('pk')[100]
+        Comment.objects.bulk_create(
+            Comment(post_id=pk, author=users[i % 200], text='Комментарий')
+            for i, pk in enumerate(
+                Post.objects.values_list('pk', flat=True)[:1000]
+            )
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(QueryPlanTest.reader)
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexedQueries(self, client, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            if data is None:
+                response = client.get(url)
+            else:
+                response = client.post(url, data)
+        self.assertLess(response.status_code, 400)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            # Полнотекстовый поиск сортирует совпадения по релевантности.
+            if search.TABLE in sql or not sql.startswith(
+                ('SELECT', 'UPDATE', 'DELETE')
+            ):
+                continue
+            # Обход таблицы по первичному ключу с LIMIT — не полный скан.
+            walk = ' WHERE ' not in sql and ' LIMIT ' in sql
+            for step in self.plan(sql):
+                with self.subTest(url=url, sql=sql, step=step):
+                    self.assertNotIn('TEMP B-TREE', step)
+                    if not walk:
+                        self.assertFalse(step.startswith('SCAN '))
+
+    def test_feed_pages_use_indexes(self):
+        post = QueryPlanTest.post
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:index') + f'?before={post.pk}',
+            reverse('posts:group_posts', kwargs={'slug': 'group-3'}),
+            reverse('posts:group_posts', kwargs={'slug': 'group-3'})
+            + f'?after={post.pk}',
+            reverse('posts:profile', kwargs={'username': 'user7'}),
+            reverse('posts:profile', kwargs={'username': 'user7'})
+            + f'?before={post.pk}',
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+            reverse('posts:search') + '?q=Пост',
+        )
+        for url in pages:
+            self.assertIndexedQueries(self.guest_client, url)
+            self.assertIndexedQueries(self.authorized_client, url)
+
+    def test_follow_page_uses_indexes(self):
+        url = reverse('posts:follow_index')
+        self.assertIndexedQueries(self.authorized_client, url)
+        self.assertIndexedQueries(
+            self.authorized_client,
+            url + f'?before={QueryPlanTest.post.pk}',
+        )
+
+    def test_writes_use_indexes(self):
+        post = QueryPlanTest.post
+        self.assertIndexedQueries(
+            self.authorized_client,
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            {'text': 'Новый комментарий'},
+        )
+        self.assertIndexedQueries(
+            self.authorized_client,
+            reverse('posts:post_create'),
+            {'text': 'Новый пост', 'group': post.group_id},
+        )
+        for name in ('profile_follow', 'profile_unfollow'):
+            self.assertIndexedQueries(
+                self.authorized_client,
+                reverse(f'posts:{name}', kwargs={'username': 'user9'}),
+            )
+
+
+class ReplicaTest(TransactionTestCase):
+    """Реплика — второй файл SQLite, который обновляет sync_replica."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        connections.databases['replica'] = {
+            **settings.DATABASES['default'],
+            'NAME': f'{cls.directory}/replica.sqlite3',
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+        shutil.rmtree(cls.directory, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer')
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+        call_command('sync_replica', stdout=StringIO())
+
+    def index_html(self, client):
+        return client.get(reverse('posts:index')).content.decode()
+
+    def test_feeds_read_from_replica_until_synced(self):
+        Post.objects.create(text='Первый пост', author=self.author)
+        self.assertNotIn('Первый пост', self.index_html(self.guest_client))
+        output = StringIO()
+        call_command('sync_replica', stdout=output)
+        self.assertIn('Синхронизаций реплики: 1', output.getvalue())
+        self.assertIn('Первый пост', self.index_html(self.guest_client))
+
+    def test_writer_reads_own_writes_from_primary(self):
+        self.authorized_client.post(
+            reverse('posts:post_create'), {'text': 'Свой пост'}
+        )
+        self.assertIn('Свой пост', self.index_html(self.authorized_client))
+        self.assertNotIn('Свой пост', self.index_html(self.guest_client))
+        cache.clear()
+        self.assertNotIn(
+            'Свой пост', self.index_html(self.authorized_client)
+        )
+
+    def test_replica_fragment_not_served_to_writer(self):
+        self.assertNotIn('Свой пост', self.index_html(self.guest_client))
+        self.authorized_client.post(
+            reverse('posts:post_create'), {'text': 'Свой пост'}
+        )
+        self.assertNotIn('Свой пост', self.index_html(self.guest_client))
+        self.assertIn('Свой пост', self.index_html(self.authorized_client))
+
+    def test_follow_visible_to_follower_before_sync(self):
+        url = reverse('posts:profile', kwargs={'username': 'star'})
+        User.objects.create_user(username='star')
+        call_command('sync_replica', stdout=StringIO())
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.context['author']._state.db, 'replica')
+        self.assertFalse(response.context['following'])
+        self.authorized_client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'star'})
+        )
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.context['author']._state.db, 'default')
+        self.assertTrue(response.context['following'])
+
+
+class ImportDataTest(TestCase):
+    rows = [
+        {'model': 'posts.follow', 'pk': 1,
+         'fields': {'user': 11, 'author': 10}},
+        {'model': 'posts.comment', 'pk': 1, 'fields': {
+            'post': 2, 'author': 11, 'text': 'Комментарий',
+            'created': '2022-02-14T18:08:00Z',
+        }},
+        *[
+            {'model': 'posts.post', 'pk': pk, 'fields': {
+                'text': f'Импортированный пост {pk}', 'author': 10,
+                'group': 1, 'pub_date': '2022-02-13T06:14:00Z',
+                'image': 'posts/ab/cd/abcd.gif' if pk < 3 else '',
+            }}
+            for pk in range(1, 6)
+        ],
+        *[
+            {'model': 'auth.user', 'pk': pk, 'fields': {
+                'username': f'imported{pk}', 'password': '!',
+                'date_joined': '2022-02-13T06:14:00Z',
+            }}
+            for pk in (10, 11)
+        ],
+        {'model': 'posts.group', 'pk': 1, 'fields': {
+            'title': 'Группа', 'slug': 'imported', 'description': '',
+        }},
+        {'model': 'sessions.session', 'pk': 'skipped', 'fields': {
+            'session_data': '', 'expire_date': '2022-02-13T06:14:00Z',
+        }},
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/dump.json'
+        with open(self.path, 'w') as dump:
+            json.dump(self.rows, dump, ensure_ascii=False, indent=1)
+
+    def test_array_streamed_across_chunks(self):
+        with open(self.path) as dump:
+            self.assertEqual(list(iter_array(dump, chunk_size=7)), self.rows)
+        for broken in ('[{"a": 1}', '[{"a": 1},]', '{"a": 1}'):
+            with self.subTest(broken=broken):
+                with self.assertRaises(ValueError):
+                    list(iter_array(StringIO(broken), chunk_size=3))
+
+    def test_rows_loaded_in_dependency_order_with_derived_data(self):
+        output = StringIO()
+        call_command(
+            'importdata', self.path, batch_size=2, exclude=['sessions'],
+            stdout=output,
+        )
+        self.assertIn('Загружено строк: 10', output.getvalue())
+        self.assertIn('строк/с', output.getvalue())
+        self.assertEqual(
+            Post.objects.filter(group__slug='imported').count(), 5
+        )
+        author = User.objects.get(username='imported10')
+        self.assertEqual(author.stats.posts_count, 5)
+        self.assertEqual(author.stats.followers_count, 1)
+        self.assertEqual(Group.objects.get(pk=1).posts_count, 5)
+        self.assertEqual(Post.objects.get(pk=2).comments_count, 1)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user_id=11).count(), 5
+        )
+        self.assertEqual(len(search.search('Импортированный')[0]), 5)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' "
+                "AND tbl_name = 'posts_post'"
+            )
+            self.assertIn(('post_group_feed',), cursor.fetchall())
+        self.assertEqual(
+            StoredFile.objects.get(name='posts/ab/cd/abcd.gif').references, 2
+        )
+
+    def test_rows_already_in_database_not_counted(self):
+        call_command(
+            'importdata', self.path, exclude=['sessions'], stdout=StringIO()
+        )
+        output = StringIO()
+        call_command(
+            'importdata', self.path, exclude=['sessions'], stdout=output
+        )
+        self.assertIn('Загружено строк: 0', output.getvalue())
+        self.assertIn('Пропущено строк, уже бывших в базе: 10',
+                      output.getvalue())
+        self.assertEqual(
+            StoredFile.objects.get(name='posts/ab/cd/abcd.gif').references, 2
+        )
+
+    def test_broken_dump_rejected(self):
+        with open(self.path, 'a') as dump:
+            dump.write(',')
+        with self.assertRaises(CommandError):
+            call_command('importdata', self.path, stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='exporter')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(
+            title='Группа', slug='export', description='',
+        )
+        Post.objects.bulk_create(
+            Post(text=f'Пост, "{i}"\nвторая строка', author=cls.user,
+                 group=cls.group)
+            for i in range(5)
+        )
+        Post.objects.create(text='Чужой пост', author=cls.other)
+        cls.post = Post.objects.filter(author=cls.user).first()
+        Comment.objects.create(
+            post=cls.post, author=cls.user, text='Комментарий'
+        )
+        Follow.objects.create(user=cls.user, author=cls.other)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_rows_fetched_in_keyset_batches(self):
+        posts = Post.objects.filter(author=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            batches = list(export.batches(posts, batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(
+            [row[0] for batch in batches for row in batch],
+            sorted(posts.values_list('pk', flat=True)),
+        )
+        self.assertEqual(len(queries), 4)
+        for query in queries[1:]:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertIn('"posts_post"."id" >', query['sql'])
+
+    def test_user_downloads_own_data(self):
+        response = self.client.get(
+            reverse('posts:export', kwargs={'data': 'posts'})
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="exporter-posts.ndjson"',
+        )
+        rows = [json.loads(line) for line in self.content(response).split(
+            '\n'
+        ) if line]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['author'], 'exporter')
+        self.assertEqual(rows[0]['group'], 'export')
+        self.assertEqual(rows[0]['text'], 'Пост, "0"\nвторая строка')
+        response = self.client.get(
+            reverse('posts:export', kwargs={'data': 'follows'}),
+            {'format': 'csv'},
+        )
+        self.assertEqual(
+            list(csv.reader(StringIO(self.content(response)))),
+            [['id', 'user', 'author'],
+             [str(Follow.objects.get().pk), 'exporter', 'other']],
+        )
+
+    def test_non_ascii_username_keeps_attachment(self):
+        self.client.force_login(
+            User.objects.create_user(username='писатель')
+        )
+        response = self.client.get(
+            reverse('posts:export', kwargs={'data': 'posts'})
+        )
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="________-posts.ndjson"; '
+            "filename*=UTF-8''%D0%BF%D0%B8%D1%81%D0%B0%D1%82%D0%B5%D0%BB"
+            "%D1%8C-posts.ndjson",
+        )
+
+    def test_unknown_export_not_found(self):
+        for data, params in (('users', {}), ('posts', {'format': 'xml'})):
+            with self.subTest(data=data, params=params):
+                response = self.client.get(
+                    reverse('posts:export', kwargs={'data': data}), params
+                )
+                self.assertEqual(response.status_code, 404)
+        response = Client().get(
+            reverse('posts:export', kwargs={'data': 'posts'})
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_admin_action_streams_selection(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse('admin:posts_post_changelist'),
+            {
+                'action': 'export_csv',
+                '_selected_action': [self.post.pk, self.other.posts.get().pk],
+            },
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(StringIO(self.content(response))))
+        self.assertEqual(
+            [row['author'] for row in rows], ['exporter', 'other']
+        )
+        self.assertEqual(rows[0]['text'], self.post.text)
+
+    def test_command_exports_to_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/comments.csv'
+        call_command(
+            'exportdata', 'comments', format='csv', user='exporter',
+            output=path, stdout=StringIO(),
+        )
+        with open(path, newline='', encoding='utf-8') as output:
+            rows = list(csv.DictReader(output))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['post'], str(self.post.pk))
+        output = StringIO()
+        call_command('exportdata', 'posts', batch_size=2, stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 6)
+        with self.assertRaises(CommandError):
+            call_command('exportdata', 'posts', user='nobody')
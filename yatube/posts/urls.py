@@ -1,7 +1,8 @@
 from django.urls import path
 from posts.views import (group_posts, index, post_create, post_detail,
                          post_edit, profile, add_comment, follow_index,
-                         profile_follow, profile_unfollow)
+                         profile_follow, profile_unfollow, post_search,
+                         export_data)
 
 app_name = 'posts'
 
@@ -10,6 +11,7 @@ urlpatterns = [
     path('profile/<str:username>/', profile, name='profile'),
     path('posts/<int:post_id>/', post_detail, name='post_detail'),
     path('group/<slug:slug>/', group_posts, name='group_posts'),
+    path('search/', post_search, name='search'),
     path('create/', post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', post_edit, name='post_edit'),
     path(
@@ -28,4 +30,5 @@ urlpatterns = [
         profile_unfollow,
         name='profile_unfollow'
     ),
+    path('export/<str:data>/', export_data, name='export'),
 ]
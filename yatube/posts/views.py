@@ -1,45 +1,78 @@
+from core import replica, writes
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
 from yatube.settings import NUM_POSTS_PER_PAGE
 
+from posts import caching, counters, export, feed, search
 from posts.forms import CommentForm, PostForm
 from posts.models import Follow, Group, Post, User
+from posts.pagination import CursorPaginator
+
+
+def cursor_page(paginator, request):
+    return paginator.get_page(
+        before=request.GET.get('before'),
+        after=request.GET.get('after'),
+    )
 
 
 def paginator(post_list, request):
-    paginator = Paginator(post_list, NUM_POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    return cursor_page(
+        CursorPaginator(post_list, NUM_POSTS_PER_PAGE),
+        request
+    )
 
 
+def feed_page(post_list, request):
+    """Страница ленты, которая выбирается при первом обращении.
+
+    Лента выводится внутри кешируемого фрагмента: если фрагмент
+    есть в кеше, запросов к постам нет вовсе.
+    """
+    return SimpleLazyObject(lambda: paginator(post_list, request))
+
+
+@replica.replica_reads
+@condition(etag_func=caching.page_etag)
 def index(request):
-    post_list = Post.objects.all()
-    page_obj = paginator(post_list, request)
+    post_list = feed.feed_posts()
+    page_obj = feed_page(post_list, request)
     context = {
         'page_obj': page_obj,
         'post_list': post_list,
+        **caching.feed_cache_context(),
     }
     return render(request, 'posts/index.html', context)
 
 
+@replica.replica_reads
+@condition(etag_func=caching.page_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = paginator(post_list, request)
+    post_list = feed.feed_posts(group.posts.all())
+    page_obj = feed_page(post_list, request)
     context = {
         'group': group,
         'page_obj': page_obj,
         'post_list': post_list,
+        **caching.feed_cache_context(),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@replica.replica_reads
+@condition(etag_func=caching.page_etag)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    count = post_list.count()
-    page_obj = paginator(post_list, request)
+    author = get_object_or_404(
+        User.objects.select_related('stats'),
+        username=username
+    )
+    post_list = feed.feed_posts(author.posts.all())
+    count = counters.stats_for(author).posts_count
+    page_obj = feed_page(post_list, request)
     user = request.user
     if (
         user.is_authenticated
@@ -57,17 +90,22 @@ def profile(request, username):
         'post_list': post_list,
         'following': following,
         'is_user_author': is_user_author,
+        **caching.feed_cache_context(),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@replica.replica_reads
+@condition(etag_func=caching.page_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        id=post_id
+    )
     form = CommentForm(request.POST or None)
     author = post.author.get_full_name()
-    user_post = post.author.posts.all()
-    count = user_post.count()
-    comments = post.comments.all()
+    count = counters.stats_for(post.author).posts_count
+    comments = post.comments.select_related('author').order_by('created')
     context = {
         'comments': comments,
         'form': form,
@@ -78,14 +116,43 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    posts, next_cursor = search.search(
+        query,
+        cursor=request.GET.get('cursor'),
+        limit=NUM_POSTS_PER_PAGE,
+    )
+    context = {
+        'query': query,
+        'posts': posts,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def save_post(form, author=None):
+    post = form.save(commit=False)
+    if author is not None:
+        post.author = author
+    post.save()
+    return post
+
+
+def save_comment(form, author, post):
+    comment = form.save(commit=False)
+    comment.author = author
+    comment.post = post
+    comment.save()
+    return comment
+
+
 @login_required
 def post_create(request):
     template = 'posts/create_post.html'
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
-        post = form.save(commit=False)
-        post.author = request.user
-        post.save()
+        writes.run(save_post, form, request.user)
         return redirect('posts:profile', request.user)
     return render(request, template, {'form': form})
 
@@ -105,8 +172,7 @@ def post_edit(request, post_id):
         return render(request, template, {'form': form,
                                           'is_edit': True,
                                           'post': post})
-    edit_post = form.save()
-    edit_post.save()
+    writes.run(save_post, form)
     return redirect('posts:post_detail', post_id)
 
 
@@ -115,36 +181,52 @@ def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
-        comment = form.save(commit=False)
-        comment.author = request.user
-        comment.post = post
-        comment.save()
+        writes.run(save_comment, form, request.user, post)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    user = request.user
-    post_list = Post.objects.filter(author__following__user=user)
-    page_obj = paginator(post_list, request)
+    page_obj = cursor_page(
+        feed.follow_paginator(request.user, NUM_POSTS_PER_PAGE),
+        request
+    )
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/follow.html', context)
 
 
+def follow(user, author):
+    return Follow.objects.get_or_create(user=user, author=author)
+
+
+def unfollow(user, author):
+    return Follow.objects.filter(user=user, author=author).delete()
+
+
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        writes.run(follow, request.user, author)
     return redirect('posts:profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    follower = Follow.objects.filter(user=request.user, author=author)
-    if follower.exists():
-        follower.delete()
+    writes.run(unfollow, request.user, author)
     return redirect('posts:profile', username=author)
+
+
+@login_required
+def export_data(request, data):
+    export_format = request.GET.get('format', 'ndjson')
+    if data not in export.SOURCES or export_format not in export.FORMATS:
+        raise Http404
+    return export.response(
+        export.owned_by(export.SOURCES[data], request.user),
+        export_format,
+        f'{request.user.username}-{data}',
+    )
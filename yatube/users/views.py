@@ -1,3 +1,7 @@
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.mail import send_mail
+from django.db import transaction
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views.generic import CreateView
 
@@ -9,6 +13,25 @@ class SignUp(CreateView):
     success_url = reverse_lazy('posts:index')
     template_name = 'users/signup.html'
 
+    @transaction.atomic
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        if self.object.email:
+            context = {
+                'user': self.object,
+                'domain': get_current_site(self.request).domain,
+                'protocol': 'https' if self.request.is_secure() else 'http',
+            }
+            send_mail(
+                render_to_string(
+                    'users/emails/welcome_subject.txt', context
+                ).strip(),
+                render_to_string('users/emails/welcome.txt', context),
+                None,
+                [self.object.email],
+            )
+        return response
+
 
 class PasswordResetForm(CreateView):
     form_class = CreationForm
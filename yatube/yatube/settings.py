@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
+
 from dotenv import load_dotenv
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,17 +42,51 @@ ALLOWED_HOSTS = [
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+WRITE_QUEUE = True
+WRITE_BATCH_WINDOW = 0.002
+WRITE_BATCH_SIZE = 50
+WRITE_MAX_ATTEMPTS = 3
+WRITE_LOCK_FILE = os.path.join(tempfile.gettempdir(), 'yatube.writes.lock')
+
+EMAIL_BACKEND = 'core.mail.OutboxBackend'
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_VISIBILITY_TIMEOUT = 5 * 60
+OUTBOX_POLL_INTERVAL = 5
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 NUM_POSTS_PER_PAGE = 10
+FEED_CELEBRITY_THRESHOLD = 1000
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
 SUCCESS_CODE = 200
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+JOBS_MAX_ATTEMPTS = 5
+JOBS_VISIBILITY_TIMEOUT = 5 * 60
+JOBS_RETRY_BACKOFF = 10
+JOBS_RETRY_BACKOFF_MAX = 60 * 60
+JOBS_POLL_INTERVAL = 1
+
+FILE_UPLOAD_HANDLERS = [
+    'core.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+POST_IMAGE_WIDTHS = (320, 640, 960, 1280)
+POST_IMAGE_RATIO = (960, 339)
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_QUALITY = 80
+POST_IMAGE_PLACEHOLDER_WIDTH = 16
+POST_IMAGE_MAX_DIMENSION = 2560
+POST_IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+IMAGE_WORKERS = 2
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -73,6 +110,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replica.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -107,9 +145,21 @@ TEMPLATES = [
     },
 ]
 
+# Тесты чистят кеш, поэтому у них свой файл, а не файл сервера,
+# запущенного на той же машине.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+CACHE_NAME = 'test-cache' if TESTING else 'cache'
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SharedMemoryCache',
+        'LOCATION': os.path.join(
+            tempfile.gettempdir(), f'yatube-{os.getuid()}', CACHE_NAME
+        ),
+        'OPTIONS': {
+            'MAX_SIZE': 64 * 1024 * 1024,
+            'SLOT_SIZE': 32 * 1024,
+        },
     }
 }
 
@@ -121,11 +171,26 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 10 * 60,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+if os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME'),
+    }
+
+DATABASE_ROUTERS = ['core.replica.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators